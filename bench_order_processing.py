@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Бенчмарки order_processing: отдельные этапы и весь process_checkout
+на синтетических корзинах, с результатами в JSON и сравнением с базовым прогоном
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import order_processing as op
+
+DEFAULT_COUPON_MIX = "none=0.25,SAVE10=0.25,SAVE20=0.25,VIP=0.25"
+
+
+def parse_coupon_mix(text: str) -> List[Tuple[Optional[str], float]]:
+    mix = []
+    for part in text.split(","):
+        code, _, weight = part.partition("=")
+        code = code.strip()
+        mix.append((None if code in ("", "none") else code, float(weight or 1)))
+    return mix
+
+
+def make_requests(orders: int, items: int, coupon_mix: Sequence[Tuple[Optional[str], float]], seed: int = 0) -> List[Dict]:
+    """Синтетические заказы: items позиций со случайными ценой и количеством"""
+    rng = random.Random(seed)
+    codes = [code for code, _ in coupon_mix]
+    weights = [weight for _, weight in coupon_mix]
+    return [
+        {
+            "user_id": rng.randint(1, 10 ** 6),
+            "items": [{"price": rng.randint(1, 500), "qty": rng.randint(1, 5)} for _ in range(items)],
+            "coupon": rng.choices(codes, weights)[0],
+            "currency": "USD",
+        }
+        for _ in range(orders)
+    ]
+
+
+def _percentile(sorted_values: List[int], fraction: float) -> int:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def measure(func: Callable, args_list: List[tuple], repeat: int = 3, ops_per_call: int = 1) -> Dict:
+    """
+    ops/s — по лучшему из repeat прогонов без таймера внутри цикла
+    (для пакетных функций одна операция — один заказ, ops_per_call);
+    p50/p99 — по замерам каждого вызова; allocations — пик tracemalloc за один прогон
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for args in args_list:
+            func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    clock = time.perf_counter_ns
+    latencies = []
+    for args in args_list:
+        t0 = clock()
+        func(*args)
+        latencies.append(clock() - t0)
+    latencies.sort()
+
+    tracemalloc.start()
+    try:
+        for args in args_list:
+            func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    calls = len(args_list)
+    return {
+        "calls": calls,
+        "ops_per_sec": calls * ops_per_call / best if best else float("inf"),
+        "p50_ns": _percentile(latencies, 0.50),
+        "p99_ns": _percentile(latencies, 0.99),
+        "alloc_peak_bytes": peak,
+    }
+
+
+def build_cases(requests: List[Dict]) -> Dict[str, Tuple[Callable, List[tuple], int]]:
+    parsed = [op.parse_request(r) for r in requests]
+    subtotals = [op.calculate_subtotal(items) for _, items, _, _ in parsed]
+
+    cases = {
+        "parse_request": (op.parse_request, [(r,) for r in requests], 1),
+        "validate_request": (op.validate_request, [(u, i, c) for u, i, _, c in parsed], 1),
+        "calculate_subtotal": (op.calculate_subtotal, [(i,) for _, i, _, _ in parsed], 1),
+        "calculate_tax_and_total": (op.calculate_tax_and_total, [(s, s // 10) for s in subtotals], 1),
+        "process_checkout": (op.process_checkout, [(r,) for r in requests], 1),
+        "process_checkout[fixed_point]": (
+            lambda r: op.process_checkout(r, rounding=op.Rounding.HALF_EVEN), [(r,) for r in requests], 1
+        ),
+        "process_checkout_batch[scalar]": (op.process_checkout_batch, [(requests, "scalar")], len(requests)),
+        "process_checkout_batch[columnar]": (op.process_checkout_batch, [(requests, "columnar")], len(requests)),
+    }
+
+    by_type: Dict[str, List[tuple]] = {}
+    for code, rule in op.OrderConstants.COUPON_RULES.items():
+        by_type.setdefault(rule["type"], []).extend((s, code) for s in subtotals)
+    for rule_type, args_list in by_type.items():
+        cases[f"calculate_discount[{rule_type}]"] = (op.calculate_discount, args_list, 1)
+    return cases
+
+
+def run(orders: int, items: int, coupon_mix: str, seed: int, repeat: int, only: Optional[str] = None) -> Dict:
+    requests = make_requests(orders, items, parse_coupon_mix(coupon_mix), seed)
+    results = {}
+    for name, (func, args_list, ops_per_call) in build_cases(requests).items():
+        if only and only not in name:
+            continue
+        results[name] = measure(func, args_list, repeat, ops_per_call)
+    return {
+        "config": {"orders": orders, "items": items, "coupon_mix": coupon_mix, "seed": seed, "repeat": repeat},
+        "python": sys.version.split()[0],
+        "results": results,
+    }
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> List[Dict]:
+    """Сравнение ops/s с базовым прогоном; regression=True, если падение больше threshold"""
+    rows = []
+    for name, result in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        ratio = result["ops_per_sec"] / base["ops_per_sec"]
+        rows.append({"name": name, "ratio": ratio, "regression": ratio < 1 - threshold})
+    return rows
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарки order_processing")
+    parser.add_argument("--orders", type=int, default=2000, help="число синтетических заказов")
+    parser.add_argument("--items", type=int, default=5, help="позиций в каждой корзине")
+    parser.add_argument("--coupons", default=DEFAULT_COUPON_MIX, help="доли купонов, например none=0.5,SAVE10=0.5")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="число прогонов для ops/s")
+    parser.add_argument("--only", help="запускать только бенчмарки, имя которых содержит строку")
+    parser.add_argument("-o", "--output", help="куда сохранить результаты в JSON")
+    parser.add_argument("--baseline", help="JSON предыдущего прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.10, help="допустимое падение ops/s")
+    args = parser.parse_args(argv)
+
+    report = run(args.orders, args.items, args.coupons, args.seed, args.repeat, args.only)
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["comparison"] = compare(report, json.load(f), args.threshold)
+        if any(row["regression"] for row in report["comparison"]):
+            exit_code = 1
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Дифференциальная проверка быстрых путей order_processing: случайные корзины
+прогоняются через эталонный process_checkout и через каждый зарегистрированный движок,
+первое расхождение возвращается вместе с входными данными
+"""
+
+import argparse
+import json
+import random
+import sys
+from functools import partial
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import order_processing as op
+
+# Результат одного заказа: словарь без order_id или текст ошибки
+Outcome = Tuple[Optional[Dict], Optional[str]]
+Engine = Callable[[List[Dict]], List[Outcome]]
+
+ENGINES: Dict[str, Engine] = {}
+# эталон движка, если он считает не как process_checkout по умолчанию (например, в целых числах)
+REFERENCES: Dict[str, Callable[[Dict], Outcome]] = {}
+
+
+def register_engine(name: str, reference: Optional[Callable[[Dict], Outcome]] = None):
+    """
+    Декоратор: движок принимает список запросов и возвращает список Outcome того же размера.
+    reference — эталон для одного запроса; по умолчанию process_checkout без параметров
+    """
+    def decorator(func: Engine) -> Engine:
+        ENGINES[name] = func
+        if reference is not None:
+            REFERENCES[name] = reference
+        else:
+            REFERENCES.pop(name, None)
+        return func
+    return decorator
+
+
+def _strip(result: Optional[Dict]) -> Optional[Dict]:
+    if result is None:
+        return None
+    return {k: v for k, v in result.items() if k != "order_id"}
+
+
+def _from_batch(results: List[Optional[Dict]], errors: List[Tuple[int, str]]) -> List[Outcome]:
+    errors_by_index = dict(errors)
+    return [(_strip(result), errors_by_index.get(i)) for i, result in enumerate(results)]
+
+
+def reference(request: Dict, rounding: Optional[str] = None) -> Outcome:
+    try:
+        return _strip(op.process_checkout(request, rounding=rounding)), None
+    except ValueError as e:
+        return None, str(e)
+
+
+@register_engine("batch[scalar]")
+def _batch_scalar(requests: List[Dict]) -> List[Outcome]:
+    return _from_batch(*op.process_checkout_batch(requests))
+
+
+@register_engine("batch[columnar]")
+def _batch_columnar(requests: List[Dict]) -> List[Outcome]:
+    return _from_batch(*op.process_checkout_batch(requests, engine="columnar"))
+
+
+def _checkout_cached(request: Dict, cache: "op.CheckoutCache") -> Outcome:
+    try:
+        return _strip(op.process_checkout(request, cache=cache)), None
+    except ValueError as e:
+        return None, str(e)
+
+
+@register_engine("cached")
+def _cached(requests: List[Dict]) -> List[Outcome]:
+    # кэш вмещает все случаи, каждый запрос сразу повторяется: второй вызов — попадание в кэш
+    cache = op.CheckoutCache(maxsize=max(len(requests), 1))
+    outcomes = []
+    for request in requests:
+        first = _checkout_cached(request, cache)
+        hits = cache.hits
+        second = _checkout_cached(request, cache)
+        if first[1] is None and cache.hits != hits + 1:
+            second = (None, "repeated request missed the cache")
+        outcomes.append(first if first == second else (None, f"cache hit differs from miss: {second}"))
+    return outcomes
+
+
+@register_engine("typed")
+def _typed(requests: List[Dict]) -> List[Outcome]:
+    results, errors = op.checkout_orders([op.Order.from_dict(r) for r in requests])
+    return _from_batch([r and r.to_dict() for r in results], errors)
+
+
+@register_engine("cart")
+def _cart(requests: List[Dict]) -> List[Outcome]:
+    outcomes = []
+    for request in requests:
+        user_id, items, coupon, currency = op.parse_request(request)
+        error = op.find_request_error(user_id, items, coupon=coupon)
+        if error is not None:
+            outcomes.append((None, error))
+            continue
+        cart = op.Cart(coupon=coupon, currency=currency)
+        for position, item in enumerate(items):
+            cart.add(position, item["price"], item["qty"])
+        try:
+            outcomes.append((_strip(cart.checkout(user_id)), None))
+        except ValueError as e:
+            outcomes.append((None, str(e)))
+    return outcomes
+
+
+def _register_fixed_point_engines(rounding: str) -> None:
+    """Целочисленный режим: оба пакетных движка против process_checkout с той же политикой округления"""
+    fixed_reference = partial(reference, rounding=rounding)
+
+    @register_engine(f"batch[scalar,{rounding}]", reference=fixed_reference)
+    def _scalar(requests: List[Dict]) -> List[Outcome]:
+        return _from_batch(*op.process_checkout_batch(requests, rounding=rounding))
+
+    @register_engine(f"batch[columnar,{rounding}]", reference=fixed_reference)
+    def _columnar(requests: List[Dict]) -> List[Outcome]:
+        return _from_batch(*op.process_checkout_batch(requests, engine="columnar", rounding=rounding))
+
+
+for _rounding in (op.Rounding.TRUNCATE, op.Rounding.FLOOR, op.Rounding.CEIL, op.Rounding.HALF_UP, op.Rounding.HALF_EVEN):
+    _register_fixed_point_engines(_rounding)
+
+
+# Границы, вокруг которых чаще всего ошибаются оптимизации
+_BOUNDARY_SUBTOTALS = (1, 2, 9, 10, 11, 99, 100, 101, 199, 200, 201)
+
+
+def random_request(rng: random.Random) -> Dict:
+    """Случайный запрос: чаще всего корректный, с суммами у порогов SAVE20/VIP и у нулевого минимума"""
+    codes = [None, *op.OrderConstants.COUPON_RULES]
+    kind = rng.random()
+    if kind < 0.4:
+        target = rng.choice(_BOUNDARY_SUBTOTALS)
+        qty = rng.choice([q for q in (1, 2, 3, 5) if target % q == 0])
+        items = [{"price": target // qty, "qty": qty}]
+    elif kind < 0.9:
+        items = [{"price": rng.randint(1, 300), "qty": rng.randint(1, 4)} for _ in range(rng.randint(1, 6))]
+    else:
+        items = rng.choice([
+            [],
+            [{"price": 0, "qty": 1}],
+            [{"price": 5, "qty": -1}],
+            [{"price": 5}],
+            [5],
+            [{"price": "5", "qty": 1}],
+            [{"price": float("nan"), "qty": 1}],
+        ])
+    request = {"user_id": rng.randint(1, 50), "items": items, "coupon": rng.choice(codes)}
+    if rng.random() < 0.05:
+        request["coupon"] = "NOPE"
+    elif rng.random() < 0.01:
+        request["coupon"] = [request["coupon"]]
+    if rng.random() < 0.5:
+        request["currency"] = rng.choice(["USD", "EUR"])
+    return request
+
+
+def run_differential(cases: int = 1000, seed: int = 0, engines: Optional[Sequence[str]] = None) -> Optional[Dict]:
+    """None, если все движки совпали с эталоном; иначе описание первого расхождения"""
+    rng = random.Random(seed)
+    requests = [random_request(rng) for _ in range(cases)]
+    expected_by_reference: Dict[Callable[[Dict], Outcome], List[Outcome]] = {}
+    for name in engines or list(ENGINES):
+        engine_reference = REFERENCES.get(name, reference)
+        expected = expected_by_reference.get(engine_reference)
+        if expected is None:
+            expected = expected_by_reference[engine_reference] = [engine_reference(r) for r in requests]
+        actual = ENGINES[name](requests)
+        for index, (want, got) in enumerate(zip(expected, actual)):
+            if want != got:
+                return {"engine": name, "index": index, "request": requests[index], "expected": want, "actual": got}
+        if len(actual) != len(expected):
+            return {"engine": name, "index": len(actual), "request": None, "expected": None, "actual": "length mismatch"}
+    return None
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Сравнение быстрых путей оформления заказа с эталоном")
+    parser.add_argument("--cases", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engine", action="append", help="проверять только указанные движки")
+    args = parser.parse_args(argv)
+
+    divergence = run_differential(args.cases, args.seed, args.engine)
+    if divergence is None:
+        print(f"OK: {args.cases} cases, engines: {', '.join(args.engine or ENGINES)}")
+        return 0
+    print(json.dumps(divergence, indent=2, default=str))
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Асинхронный сервис оформления заказов: объединяет одновременные запросы
+в микропакеты для process_checkout_batch и принимает NDJSON по TCP или Unix-сокету
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from order_processing import ValidationLevel, process_checkout_batch
+
+
+class CheckoutCoalescer:
+    """
+    Очередь запросов с ограниченным размером: запросы собираются в пакет,
+    пока не наберётся max_batch или не пройдёт max_delay секунд с первого запроса.
+    Полная очередь заставляет submit ждать (backpressure), но не дольше дедлайна запроса
+    """
+
+    def __init__(
+        self,
+        max_batch: int = 256,
+        max_delay: float = 0.002,
+        max_queue: int = 10000,
+        timeout: Optional[float] = 1.0,
+        validation: str = ValidationLevel.FULL,
+    ):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.validation = validation
+        self._queue: "asyncio.Queue[Tuple[Dict, asyncio.Future, Optional[float]]]" = asyncio.Queue(max_queue)
+        self._worker: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.expired = 0
+
+    async def start(self) -> None:
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def submit(self, request: Dict, timeout: Optional[float] = None) -> Dict:
+        """Результат заказа; ValueError для некорректного заказа, asyncio.TimeoutError по дедлайну"""
+        loop = asyncio.get_running_loop()
+        timeout = self.timeout if timeout is None else timeout
+        deadline = loop.time() + timeout if timeout is not None else None
+        future = loop.create_future()
+        await asyncio.wait_for(self._queue.put((request, future, deadline)), timeout)
+        remaining = deadline - loop.time() if deadline is not None else None
+        return await asyncio.wait_for(future, remaining)
+
+    async def _collect(self) -> List[Tuple[Dict, asyncio.Future, Optional[float]]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        flush_at = loop.time() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = flush_at - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            now = loop.time()
+            live = []
+            for entry in batch:
+                _, future, deadline = entry
+                if future.done():
+                    continue
+                if deadline is not None and deadline <= now:
+                    self.expired += 1
+                    future.set_exception(asyncio.TimeoutError())
+                    continue
+                live.append(entry)
+            if not live:
+                continue
+
+            self.batches += 1
+            try:
+                self._resolve(live)
+            except Exception:
+                # пакет упал целиком (например, позиция без price при validation=trusted): заказы пересчитываются
+                # по одному, исключение получает только запрос, который его вызвал
+                for entry in live:
+                    try:
+                        self._resolve([entry])
+                    except Exception as e:
+                        if not entry[1].done():
+                            entry[1].set_exception(e)
+
+    def _resolve(self, live: List[Tuple[Dict, asyncio.Future, Optional[float]]]) -> None:
+        results, errors = process_checkout_batch([request for request, _, _ in live], validation=self.validation)
+        errors_by_index = dict(errors)
+        for index, (_, future, _) in enumerate(live):
+            if future.done():
+                continue
+            if index in errors_by_index:
+                future.set_exception(ValueError(errors_by_index[index]))
+            else:
+                future.set_result(results[index])
+
+
+async def _respond(coalescer: CheckoutCoalescer, line: bytes) -> Dict:
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            return {"error": "request must be a json object"}
+        return await coalescer.submit(request)
+    except asyncio.TimeoutError:
+        return {"error": "deadline exceeded"}
+    except ValueError as e:
+        return {"error": str(e)}
+    except Exception as e:
+        # любая другая ошибка остаётся ответом на свою строку и не обрывает соединение
+        logging.getLogger("checkout_service").exception("checkout failed")
+        return {"error": f"{type(e).__name__}: {e}"}
+
+
+def make_handler(coalescer: CheckoutCoalescer, pipeline_depth: int = 128):
+    """Обработчик соединения: строки NDJSON обрабатываются конкурентно, ответы уходят в порядке запросов"""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        pending: "asyncio.Queue[Optional[asyncio.Task]]" = asyncio.Queue(pipeline_depth)
+
+        async def write_responses():
+            while True:
+                task = await pending.get()
+                if task is None:
+                    break
+                writer.write(json.dumps(await task).encode() + b"\n")
+                await writer.drain()
+
+        reader_task = asyncio.current_task()
+
+        def stop_reading(task: asyncio.Task) -> None:
+            # писатель упал (например, клиент сбросил соединение): иначе чтение застрянет на полной очереди
+            if not task.cancelled() and task.exception() is not None:
+                reader_task.cancel()
+
+        writer_task = asyncio.create_task(write_responses())
+        writer_task.add_done_callback(stop_reading)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    await pending.put(asyncio.create_task(_respond(coalescer, line)))
+            await pending.put(None)
+            await writer_task
+        except asyncio.CancelledError:
+            if not writer_task.done() or writer_task.cancelled():
+                raise
+        finally:
+            writer_task.cancel()
+            while not pending.empty():
+                task = pending.get_nowait()
+                if task is not None:
+                    task.cancel()
+            writer.close()
+
+    return handle
+
+
+async def serve(
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    unix_path: Optional[str] = None,
+    coalescer: Optional[CheckoutCoalescer] = None,
+) -> None:
+    coalescer = coalescer or CheckoutCoalescer()
+    async with coalescer:
+        handler = make_handler(coalescer)
+        if unix_path:
+            server = await asyncio.start_unix_server(handler, path=unix_path)
+        else:
+            server = await asyncio.start_server(handler, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Сервис оформления заказов (NDJSON)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="путь к Unix-сокету вместо TCP")
+    parser.add_argument("--max-batch", type=int, default=256, help="максимальный размер микропакета")
+    parser.add_argument("--max-delay-ms", type=float, default=2.0, help="задержка сброса микропакета")
+    parser.add_argument("--max-queue", type=int, default=10000, help="ёмкость очереди запросов")
+    parser.add_argument("--timeout-ms", type=float, default=1000.0, help="дедлайн запроса")
+    args = parser.parse_args(argv)
+
+    async def run():
+        coalescer = CheckoutCoalescer(
+            max_batch=args.max_batch,
+            max_delay=args.max_delay_ms / 1000,
+            max_queue=args.max_queue,
+            timeout=args.timeout_ms / 1000,
+        )
+        await serve(args.host, args.port, args.unix, coalescer)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -50,7 +50,8 @@ def run_all_patterns():
         ("🎯 SINGLETON", "singleton", "demonstrate_singleton"),
         ("🏭 FACTORY METHOD", "factory_method", "demonstrate_factory_method"),
         ("🏗️ ABSTRACT FACTORY", "abstract_factory", "demonstrate_abstract_factory"),
-        ("🔨 BUILDER", "builder", "demonstrate_builder")
+        ("🔨 BUILDER", "builder", "demonstrate_builder"),
+        ("🏊 OBJECT POOL", "connection_pool", "demonstrate_connection_pool")
     ]
     
     for name, module, func in patterns:
@@ -59,7 +60,7 @@ def run_all_patterns():
         print('═' * 60)
         load_and_run(module, func)
         
-        if name != "🔨 BUILDER":
+        if name != "🏊 OBJECT POOL":
             input("\n↵ Нажмите Enter для следующего паттерна...")
             clear_screen()
             print_header()
@@ -73,7 +74,8 @@ def show_menu():
     print("║  2. 🏭 Factory Method (Фабричный метод)                 ║")
     print("║  3. 🏗️ Abstract Factory (Абстрактная фабрика)           ║")
     print("║  4. 🔨 Builder (Строитель)                              ║")
-    print("║  5. 🚀 Запустить ВСЕ паттерны                           ║")
+    print("║  5. 🏊 Object Pool (Пул объектов)                       ║")
+    print("║  6. 🚀 Запустить ВСЕ паттерны                           ║")
     print("║  0. 🚪 Выход                                            ║")
     print("╚══════════════════════════════════════════════════════════╝")
 
@@ -86,7 +88,7 @@ def main():
         show_menu()
         
         try:
-            choice = input("\n👉 Выберите опцию (0-5): ").strip()
+            choice = input("\n👉 Выберите опцию (0-6): ").strip()
             
             if choice == "0":
                 print("\n👋 Спасибо за использование! До свидания!")
@@ -125,6 +127,14 @@ def main():
                 print_header()
             
             elif choice == "5":
+                clear_screen()
+                print_header()
+                load_and_run("connection_pool", "demonstrate_connection_pool")
+                input("\n↵ Нажмите Enter чтобы вернуться в меню...")
+                clear_screen()
+                print_header()
+            
+            elif choice == "6":
                 clear_screen()
                 print_header()
                 run_all_patterns()
@@ -133,7 +143,7 @@ def main():
                 print_header()
             
             else:
-                print("\n❌ Неверный выбор. Пожалуйста, введите число от 0 до 5.")
+                print("\n❌ Неверный выбор. Пожалуйста, введите число от 0 до 6.")
                 input("↵ Нажмите Enter чтобы продолжить...")
                 clear_screen()
                 print_header()
@@ -1,9 +1,33 @@
-from typing import Dict, List, Tuple, Optional
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from itertools import count, islice, product
+from math import isfinite
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, TextIO, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy нужен только колоночному движку, без него он считает поэлементно
+    np = None
 
 class OrderConstants:
     """Константы для обработки заказов"""
     DEFAULT_CURRENCY = "USD"
     TAX_RATE = 0.21
+    TAX_RATE_BP = 2100
+    BASIS_POINTS = 10000
     MIN_TOTAL_AFTER_DISCOUNT = 0
     
     COUPON_RULES = {
@@ -20,69 +44,1041 @@ def parse_request(request: Dict):
         request.get("currency"),
     )
 
-def validate_request(user_id, items, currency):
+class ValidationLevel:
+    """Уровни проверки запроса"""
+    FULL = "full"          # структура и значения каждой позиции
+    SCHEMA = "schema"      # только структура: поля и типы
+    TRUSTED = "trusted"    # проверки пропускаются, запрос уже проверен выше по цепочке
+
+_NUMBER_TYPES = (int, float)
+
+def find_item_error(item) -> Optional[str]:
+    """Структура позиции: словарь с числовыми price и qty"""
+    if not isinstance(item, dict):
+        return "item must be an object"
+    if "price" not in item or "qty" not in item:
+        return "item must have price and qty"
+    if not isinstance(item["price"], _NUMBER_TYPES):
+        return "price must be a number"
+    if not isinstance(item["qty"], _NUMBER_TYPES):
+        return "qty must be a number"
+    # JSON пропускает NaN и Infinity: NaN проходит проверку <= 0, а int() от них падает на всём пакете
+    if item["price"].__class__ is float and not isfinite(item["price"]):
+        return "price must be finite"
+    if item["qty"].__class__ is float and not isfinite(item["qty"]):
+        return "qty must be finite"
+    return None
+
+def find_request_error(user_id, items, level: str = ValidationLevel.FULL, coupon=None) -> Optional[str]:
+    if level == ValidationLevel.TRUSTED:
+        return None
+    if level != ValidationLevel.FULL and level != ValidationLevel.SCHEMA:
+        raise ValueError(f"unknown validation level: {level}")
     if user_id is None:
-        raise ValueError("user_id is required")
+        return "user_id is required"
     if items is None:
-        raise ValueError("items is required")
+        return "items is required"
     if not isinstance(items, list):
-        raise ValueError("items must be a list")
+        return "items must be a list"
     if len(items) == 0:
-        raise ValueError("items must not be empty")
+        return "items must not be empty"
+    if coupon is not None and not isinstance(coupon, str):
+        return "coupon must be a string"
     
     for item in items:
-        if "price" not in item or "qty" not in item:
-            raise ValueError("item must have price and qty")
-        if item["price"] <= 0:
-            raise ValueError("price must be positive")
-        if item["qty"] <= 0:
-            raise ValueError("qty must be positive")
+        error = find_item_error(item)
+        if error is not None:
+            return error
+        if level == ValidationLevel.FULL:
+            if item["price"] <= 0:
+                return "price must be positive"
+            if item["qty"] <= 0:
+                return "qty must be positive"
+    
+    return None
+
+def validate_request(user_id, items, currency, level: str = ValidationLevel.FULL, coupon=None):
+    error = find_request_error(user_id, items, level, coupon)
+    if error is not None:
+        raise ValueError(error)
     
     return currency if currency is not None else OrderConstants.DEFAULT_CURRENCY
 
+def validate_batch(requests: Sequence[Dict]) -> List[Tuple[int, Optional[int], str]]:
+    """
+    Проверка пакета целиком: возвращает все найденные ошибки в виде
+    (индекс заказа, индекс позиции или None, сообщение), не останавливаясь на первой
+    """
+    problems: List[Tuple[int, Optional[int], str]] = []
+    owners: List[int] = []
+    positions: List[int] = []
+    prices: List = []
+    qtys: List = []
+    
+    for index, request in enumerate(requests):
+        if not isinstance(request, dict):
+            problems.append((index, None, "request must be an object"))
+            continue
+        if request.get("user_id") is None:
+            problems.append((index, None, "user_id is required"))
+        items = request.get("items")
+        if items is None:
+            problems.append((index, None, "items is required"))
+            continue
+        if not isinstance(items, list):
+            problems.append((index, None, "items must be a list"))
+            continue
+        if len(items) == 0:
+            problems.append((index, None, "items must not be empty"))
+            continue
+        coupon = request.get("coupon")
+        if coupon is not None and not isinstance(coupon, str):
+            problems.append((index, None, "coupon must be a string"))
+        
+        for position, item in enumerate(items):
+            error = find_item_error(item)
+            if error is not None:
+                problems.append((index, position, error))
+                continue
+            owners.append(index)
+            positions.append(position)
+            prices.append(item["price"])
+            qtys.append(item["qty"])
+    
+    for k in [k for k, price in enumerate(prices) if price <= 0]:
+        problems.append((owners[k], positions[k], "price must be positive"))
+    for k in [k for k, qty in enumerate(qtys) if qty <= 0]:
+        problems.append((owners[k], positions[k], "qty must be positive"))
+    
+    problems.sort(key=lambda p: (p[0], -1 if p[1] is None else p[1]))
+    return problems
+
 def calculate_subtotal(items: List[Dict]) -> int:
     return sum(item["price"] * item["qty"] for item in items)
 
-def calculate_discount(subtotal: int, coupon: Optional[str]) -> int:
-    if not coupon:
+class Rounding:
+    """Политики округления для целочисленной арифметики в базисных пунктах"""
+    TRUNCATE = "truncate"    # к нулю, как int() в вычислениях с float
+    FLOOR = "floor"
+    CEIL = "ceil"
+    HALF_UP = "half_up"      # половина — от нуля
+    HALF_EVEN = "half_even"  # банковское округление
+
+_ROUNDING_POLICIES = frozenset((Rounding.TRUNCATE, Rounding.FLOOR, Rounding.CEIL, Rounding.HALF_UP, Rounding.HALF_EVEN))
+
+def check_rounding(rounding: str) -> None:
+    if rounding not in _ROUNDING_POLICIES:
+        raise ValueError(f"unknown rounding: {rounding}")
+
+def to_basis_points(rate: float) -> int:
+    return round(rate * OrderConstants.BASIS_POINTS)
+
+def apply_rate_bp(amount: int, rate_bp: int, rounding: str = Rounding.TRUNCATE) -> int:
+    """amount * rate_bp / 10000 в целых числах с заданной политикой округления"""
+    return divide_rounded(amount * rate_bp, OrderConstants.BASIS_POINTS, rounding)
+
+def divide_rounded(product: int, scale: int, rounding: str = Rounding.TRUNCATE) -> int:
+    check_rounding(rounding)
+    if rounding == Rounding.TRUNCATE:
+        return product // scale if product >= 0 else -(-product // scale)
+    
+    quotient, remainder = divmod(product, scale)
+    if remainder == 0 or rounding == Rounding.FLOOR:
+        return quotient
+    if rounding == Rounding.CEIL:
+        return quotient + 1
+    
+    twice = 2 * remainder
+    if twice != scale:
+        return quotient + (twice > scale)
+    if rounding == Rounding.HALF_UP:
+        return quotient + (product > 0)
+    return quotient + (quotient & 1)
+
+def divide_rounded_column(products, scale: int, rounding: str):
+    """divide_rounded для массива NumPy: те же политики, поэлементно"""
+    check_rounding(rounding)
+    quotients, remainders = np.divmod(products, scale)
+    if rounding == Rounding.FLOOR:
+        return quotients
+    inexact = remainders != 0
+    if rounding == Rounding.TRUNCATE:
+        return quotients + (inexact & (products < 0))
+    if rounding == Rounding.CEIL:
+        return quotients + inexact
+    
+    twice = 2 * remainders
+    if rounding == Rounding.HALF_UP:
+        return quotients + (twice > scale) + ((twice == scale) & (products > 0))
+    return quotients + (twice > scale) + ((twice == scale) & ((quotients & 1) == 1))
+
+COUPON_RULE_TYPES: Dict[str, type] = {}
+
+def register_rule_type(name: str):
+    """Декоратор: регистрирует класс правила для типа купона"""
+    def decorator(cls):
+        COUPON_RULE_TYPES[name] = cls
+        return cls
+    return decorator
+
+class CouponRule:
+    """Скомпилированное правило купона; неизвестные типы дают скидку 0"""
+    __slots__ = ()
+    
+    def __init__(self, rule: Dict):
+        pass
+    
+    def __call__(self, subtotal: int) -> int:
         return 0
     
-    if coupon not in OrderConstants.COUPON_RULES:
-        raise ValueError("unknown coupon")
+    def apply_column(self, subtotals):
+        """Скидки для массива NumPy; по умолчанию — поэлементно через __call__"""
+        return np.array([self(s) for s in subtotals.tolist()])
+    
+    def fixed(self, subtotal: int, rounding: str) -> int:
+        """Скидка в целочисленном режиме; правила без ставок совпадают с __call__"""
+        return self(subtotal)
     
-    rule = OrderConstants.COUPON_RULES[coupon]
+    def apply_column_fixed(self, subtotals, rounding: str):
+        return np.array([self.fixed(s, rounding) for s in subtotals.tolist()])
+
+@register_rule_type("percentage")
+class PercentageRule(CouponRule):
+    __slots__ = ("rate", "rate_bp")
+    
+    def __init__(self, rule: Dict):
+        self.rate = rule["value"]
+        self.rate_bp = to_basis_points(self.rate)
+    
+    def __call__(self, subtotal: int) -> int:
+        return int(subtotal * self.rate)
+    
+    def apply_column(self, subtotals):
+        return np.trunc(subtotals * self.rate).astype(np.int64)
+    
+    def fixed(self, subtotal: int, rounding: str) -> int:
+        return apply_rate_bp(subtotal, self.rate_bp, rounding)
+    
+    def apply_column_fixed(self, subtotals, rounding: str):
+        return divide_rounded_column(subtotals * self.rate_bp, OrderConstants.BASIS_POINTS, rounding)
+
+@register_rule_type("tiered")
+class TieredRule(CouponRule):
+    __slots__ = ("high", "low", "threshold", "high_bp", "low_bp")
     
-    if rule["type"] == "percentage":
-        return int(subtotal * rule["value"])
+    def __init__(self, rule: Dict):
+        self.high = rule["high"]
+        self.low = rule["low"]
+        self.threshold = rule["threshold"]
+        self.high_bp = to_basis_points(self.high)
+        self.low_bp = to_basis_points(self.low)
     
-    elif rule["type"] == "tiered":
-        rate = rule["high"] if subtotal >= rule["threshold"] else rule["low"]
-        return int(subtotal * rate)
+    def __call__(self, subtotal: int) -> int:
+        return int(subtotal * (self.high if subtotal >= self.threshold else self.low))
     
-    elif rule["type"] == "fixed_conditional":
-        return rule["value"] if subtotal >= rule["min_for_value"] else rule["fallback"]
+    def apply_column(self, subtotals):
+        rates = np.where(subtotals >= self.threshold, self.high, self.low)
+        return np.trunc(subtotals * rates).astype(np.int64)
     
-    return 0
+    def fixed(self, subtotal: int, rounding: str) -> int:
+        return apply_rate_bp(subtotal, self.high_bp if subtotal >= self.threshold else self.low_bp, rounding)
+    
+    def apply_column_fixed(self, subtotals, rounding: str):
+        rates_bp = np.where(subtotals >= self.threshold, self.high_bp, self.low_bp)
+        return divide_rounded_column(subtotals * rates_bp, OrderConstants.BASIS_POINTS, rounding)
+
+@register_rule_type("fixed_conditional")
+class FixedConditionalRule(CouponRule):
+    __slots__ = ("value", "fallback", "min_for_value")
+    
+    def __init__(self, rule: Dict):
+        self.value = rule["value"]
+        self.fallback = rule["fallback"]
+        self.min_for_value = rule["min_for_value"]
+    
+    def __call__(self, subtotal: int) -> int:
+        return self.value if subtotal >= self.min_for_value else self.fallback
+    
+    def apply_column(self, subtotals):
+        return np.where(subtotals >= self.min_for_value, self.value, self.fallback)
+    
+    def apply_column_fixed(self, subtotals, rounding: str):
+        return self.apply_column(subtotals)
+
+def compile_coupon_rule(rule: Dict) -> CouponRule:
+    return COUPON_RULE_TYPES.get(rule["type"], CouponRule)(rule)
 
-def calculate_tax_and_total(subtotal: int, discount: int) -> Tuple[int, int]:
+def _parse_timestamp(value) -> Optional[float]:
+    """Unix-время или ISO 8601; время без часового пояса считается UTC, а не локальным"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+class CouponEntry:
+    """Купон в хранилище: скомпилированное правило, окно действия и лимит использований"""
+    __slots__ = ("code", "rule", "starts_at", "ends_at", "usage_limit", "constrained")
+    
+    def __init__(self, code: str, rule: CouponRule, starts_at=None, ends_at=None, usage_limit: Optional[int] = None):
+        self.code = code
+        self.rule = rule
+        self.starts_at = _parse_timestamp(starts_at)
+        self.ends_at = _parse_timestamp(ends_at)
+        self.usage_limit = usage_limit
+        self.constrained = self.starts_at is not None or self.ends_at is not None or usage_limit is not None
+    
+    @classmethod
+    def from_dict(cls, code: str, data: Dict) -> "CouponEntry":
+        return cls(code, compile_coupon_rule(data), data.get("starts_at"), data.get("ends_at"), data.get("usage_limit"))
+
+class CouponStore:
+    """
+    Индекс купонов в памяти. Любое изменение собирает новый словарь и подменяет ссылку
+    целиком (copy-on-write), поэтому чтение никогда не ждёт перезагрузку.
+    Счётчики использований не зависят от перезагрузок
+    """
+    
+    def __init__(self, rules: Optional[Dict[str, Dict]] = None, clock=time.time):
+        self._clock = clock
+        self._index: Dict[str, CouponEntry] = {}
+        self._usage: Dict[str, int] = {}
+        self._write_lock = threading.Lock()
+        self._source = None
+        self._signature = None
+        self.version = 0
+        if rules:
+            self.replace(rules)
+    
+    def _swap(self, index: Dict[str, CouponEntry]) -> None:
+        self._index = index
+        self.version += 1
+    
+    def replace(self, rules: Dict[str, Dict]) -> None:
+        index = {code: CouponEntry.from_dict(code, data) for code, data in rules.items()}
+        with self._write_lock:
+            self._swap(index)
+    
+    def register(self, code: str, rule: Dict) -> None:
+        entry = CouponEntry.from_dict(code, rule)
+        with self._write_lock:
+            index = dict(self._index)
+            index[code] = entry
+            self._swap(index)
+    
+    def unregister(self, code: str) -> None:
+        with self._write_lock:
+            if code in self._index:
+                index = dict(self._index)
+                del index[code]
+                self._swap(index)
+    
+    def load_json(self, path: str) -> None:
+        """Файл вида {"coupons": {"CODE": {"type": ..., "starts_at": ..., "usage_limit": ...}}}"""
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        self.replace(data.get("coupons", data))
+        self._source = ("json", path)
+        self._signature = self._stat(path)
+    
+    def load_sqlite(self, path: str, table: str = "coupons") -> None:
+        """Таблица (code, rule, starts_at, ends_at, usage_limit), rule — JSON правила"""
+        if not table.isidentifier():
+            raise ValueError(f"invalid table name: {table!r}")
+        connection = sqlite3.connect(path)
+        try:
+            rows = connection.execute(f'SELECT code, rule, starts_at, ends_at, usage_limit FROM "{table}"').fetchall()
+        finally:
+            connection.close()
+        rules = {}
+        for code, rule, starts_at, ends_at, usage_limit in rows:
+            data = json.loads(rule)
+            data.update(starts_at=starts_at, ends_at=ends_at, usage_limit=usage_limit)
+            rules[code] = data
+        self.replace(rules)
+        self._source = ("sqlite", path, table)
+        self._signature = self._stat(path)
+    
+    @staticmethod
+    def _stat(path: str) -> Tuple[int, int]:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    
+    def reload(self) -> bool:
+        """Перечитывает последний источник, если файл изменился"""
+        if self._source is None or self._stat(self._source[1]) == self._signature:
+            return False
+        if self._source[0] == "json":
+            self.load_json(self._source[1])
+        else:
+            self.load_sqlite(self._source[1], self._source[2])
+        return True
+    
+    def find(self, code: str) -> Optional[CouponRule]:
+        entry = self._index.get(code)
+        if entry is None:
+            return None
+        if entry.constrained and self._unavailable(entry) is not None:
+            return None
+        return entry.rule
+    
+    def _unavailable(self, entry: CouponEntry) -> Optional[str]:
+        now = self._clock()
+        if entry.starts_at is not None and now < entry.starts_at:
+            return "coupon is not active yet"
+        if entry.ends_at is not None and now >= entry.ends_at:
+            return "coupon expired"
+        if entry.usage_limit is not None and self._usage.get(entry.code, 0) >= entry.usage_limit:
+            return "coupon usage limit reached"
+        return None
+    
+    def unavailable_reason(self, code: str) -> Optional[str]:
+        entry = self._index.get(code)
+        if entry is None:
+            return "unknown coupon"
+        return self._unavailable(entry)
+    
+    def redeem(self, code: str) -> bool:
+        """Засчитывает использование купона; False, если купон недоступен"""
+        with self._write_lock:
+            entry = self._index.get(code)
+            if entry is None or self._unavailable(entry) is not None:
+                return False
+            self._usage[code] = self._usage.get(code, 0) + 1
+            return True
+    
+    def consume(self, code: str) -> bool:
+        """
+        Засчитывает использование при оформлении заказа: купоны с лимитом — через redeem,
+        купоны без лимита только проверяются на наличие, без блокировки
+        """
+        entry = self._index.get(code)
+        if entry is None:
+            return False
+        if entry.usage_limit is None:
+            return True
+        return self.redeem(code)
+    
+    def usage(self, code: str) -> int:
+        return self._usage.get(code, 0)
+    
+    def __getstate__(self):
+        # копия для процессов-воркеров: блокировка не сериализуется и создаётся заново
+        state = self.__dict__.copy()
+        del state["_write_lock"]
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._write_lock = threading.Lock()
+    
+    def __contains__(self, code: str) -> bool:
+        return code in self._index
+    
+    def __len__(self):
+        return len(self._index)
+
+_coupon_store = CouponStore(OrderConstants.COUPON_RULES)
+
+def get_coupon_store() -> CouponStore:
+    return _coupon_store
+
+def set_coupon_store(store: CouponStore) -> CouponStore:
+    """Подменяет хранилище купонов, из которого читает calculate_discount; возвращает предыдущее"""
+    global _coupon_store
+    previous, _coupon_store = _coupon_store, store
+    return previous
+
+def register_coupon(code: str, rule: Dict) -> None:
+    OrderConstants.COUPON_RULES[code] = rule
+    _coupon_store.register(code, rule)
+
+def unregister_coupon(code: str) -> None:
+    OrderConstants.COUPON_RULES.pop(code, None)
+    _coupon_store.unregister(code)
+
+def find_coupon_rule(coupon: str) -> Optional[CouponRule]:
+    return _coupon_store.find(coupon)
+
+def coupon_error(coupon: str) -> str:
+    return _coupon_store.unavailable_reason(coupon) or "unknown coupon"
+
+def get_coupon_rule(coupon: str) -> CouponRule:
+    compiled = _coupon_store.find(coupon)
+    if compiled is None:
+        raise ValueError(coupon_error(coupon))
+    return compiled
+
+def consume_coupon(coupon: str) -> None:
+    """Последний шаг успешного оформления: расходует использование купона с лимитом"""
+    if not _coupon_store.consume(coupon):
+        raise ValueError(coupon_error(coupon))
+
+def calculate_discount(subtotal: int, coupon: Optional[str], rounding: Optional[str] = None) -> int:
+    if rounding is None:
+        return get_coupon_rule(coupon)(subtotal) if coupon else 0
+    check_rounding(rounding)
+    return get_coupon_rule(coupon).fixed(subtotal, rounding) if coupon else 0
+
+def calculate_tax_and_total(subtotal: int, discount: int, rounding: Optional[str] = None) -> Tuple[int, int]:
     total_after_discount = max(subtotal - discount, OrderConstants.MIN_TOTAL_AFTER_DISCOUNT)
-    tax = int(total_after_discount * OrderConstants.TAX_RATE)
+    if rounding is None:
+        tax = int(total_after_discount * OrderConstants.TAX_RATE)
+    else:
+        tax = apply_rate_bp(total_after_discount, OrderConstants.TAX_RATE_BP, rounding)
     total = total_after_discount + tax
     return tax, total
 
+_ID_GENERATORS: "weakref.WeakSet" = weakref.WeakSet()
+
+class SnowflakeIdGenerator:
+    """
+    64-битные id: 41 бит — миллисекунды от EPOCH_MS, 10 бит — номер воркера,
+    12 бит — последовательность внутри миллисекунды (до 4096 id/мс на воркер).
+    worker_id обязателен и должен быть уникален среди всех процессов и хостов, выдающих id.
+    Генератор, унаследованный через fork(), сохраняет worker_id родителя, и оба процесса
+    выдают одинаковые id: дочернему процессу нужен свой генератор со своим worker_id
+    """
+    EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+    WORKER_BITS = 10
+    SEQUENCE_BITS = 12
+    MAX_WORKER = (1 << WORKER_BITS) - 1
+    MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+    
+    def __init__(self, worker_id: int):
+        if not 0 <= worker_id <= self.MAX_WORKER:
+            raise ValueError(f"worker_id must be in 0..{self.MAX_WORKER}")
+        self.worker_id = worker_id
+        self._worker_bits = worker_id << self.SEQUENCE_BITS
+        self._lock = threading.Lock()
+        self._reset()
+        _ID_GENERATORS.add(self)
+    
+    def _reset(self) -> None:
+        self._last_ms = -1
+        self._sequence = 0
+    
+    def __call__(self) -> int:
+        with self._lock:
+            now = time.time_ns() // 1_000_000 - self.EPOCH_MS
+            if now <= self._last_ms:
+                # та же миллисекунда или часы ушли назад: продолжаем от последней метки
+                now = self._last_ms
+                self._sequence = (self._sequence + 1) & self.MAX_SEQUENCE
+                if self._sequence == 0:
+                    now += 1
+                    while time.time_ns() // 1_000_000 - self.EPOCH_MS < now:
+                        time.sleep(0)
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            return (now << (self.WORKER_BITS + self.SEQUENCE_BITS)) | self._worker_bits | self._sequence
+
+class UlidGenerator:
+    """
+    ULID: 48 бит миллисекунд + 80 случайных бит в base32 Crockford (26 символов).
+    Внутри одной миллисекунды случайная часть увеличивается на 1, поэтому id монотонны.
+    Не требует номера воркера: после fork() случайная часть выбирается заново.
+    Первые 22 символа (время и старшие 60 случайных бит) кэшируются и пересчитываются
+    раз в миллисекунду или при переносе из младших 20 бит; за вызов кодируются 4 символа.
+    Snowflake (целые id) ещё быстрее, но требует уникального номера воркера:
+    set_order_id_generator(SnowflakeIdGenerator(worker_id=...))
+    """
+    ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+    RANDOM_BITS = 80
+    LOW_BITS = 20
+    _LOW_MASK = (1 << LOW_BITS) - 1
+    # 10 бит за один поиск: 13 пар символов дают 26 символов (130 бит, старшие 2 — нули)
+    _PAIRS = [a + b for a, b in product(ALPHABET, repeat=2)]
+    _SHIFTS = tuple(range(120, -1, -10))
+    _PREFIX_SHIFTS = _SHIFTS[:-2]
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+        _ID_GENERATORS.add(self)
+    
+    def _reset(self) -> None:
+        self._last_ms = -1
+        self._random = 0
+        self._prefix = None
+    
+    def __call__(self) -> str:
+        pairs = self._PAIRS
+        with self._lock:
+            now = time.time_ns() // 1_000_000
+            if now > self._last_ms:
+                self._last_ms = now
+                self._random = int.from_bytes(os.urandom(10), "big")
+                self._prefix = None
+            else:
+                # та же миллисекунда или часы ушли назад: продолжаем от последней метки
+                self._random += 1
+                if self._random >> self.RANDOM_BITS:
+                    self._last_ms += 1
+                    self._random = int.from_bytes(os.urandom(10), "big")
+                    self._prefix = None
+                elif not self._random & self._LOW_MASK:
+                    self._prefix = None
+            prefix = self._prefix
+            if prefix is None:
+                value = (self._last_ms << self.RANDOM_BITS) | self._random
+                prefix = self._prefix = "".join([pairs[(value >> shift) & 1023] for shift in self._PREFIX_SHIFTS])
+            low = self._random & self._LOW_MASK
+        return prefix + pairs[low >> 10] + pairs[low & 1023]
+
+def _reset_id_generators_after_fork() -> None:
+    for generator in list(_ID_GENERATORS):
+        generator._lock = threading.Lock()
+        generator._reset()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_id_generators_after_fork)
+
+# Snowflake требует уникального worker_id на процесс, поэтому по умолчанию — ULID
+_order_id_generator: Callable[[], object] = UlidGenerator()
+
+def set_order_id_generator(generator: Callable[[], object]) -> Callable[[], object]:
+    """Подменяет генератор уникальной части order_id; возвращает предыдущий"""
+    global _order_id_generator
+    previous, _order_id_generator = _order_id_generator, generator
+    return previous
+
 def generate_order_id(user_id: int, items_count: int) -> str:
-    return f"{user_id}-{items_count}-X"
+    return f"{user_id}-{items_count}-{_order_id_generator()}"
+
+class PricingSnapshot:
+    """
+    Неизменяемый снимок курсов и налоговых ставок: курс хранится в миллионных долях,
+    налог — в базисных пунктах; поиск по (валюта, регион) за O(1).
+    version берётся из файла и может повторяться; revision — уникальный номер снимка
+    в процессе, по нему снимки различают кэш и откат
+    """
+    FX_SCALE = 1_000_000
+    _revisions = count(1)
+    
+    __slots__ = ("version", "revision", "base_currency", "rates")
+    
+    def __init__(self, version: str, base_currency: str, rates: Dict[Tuple[str, Optional[str]], Tuple[int, int]]):
+        self.version = version
+        self.revision = next(PricingSnapshot._revisions)
+        self.base_currency = base_currency
+        self.rates = rates
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "PricingSnapshot":
+        base = data.get("base_currency", OrderConstants.DEFAULT_CURRENCY)
+        default_tax = data.get("tax_rate", OrderConstants.TAX_RATE)
+        rates: Dict[Tuple[str, Optional[str]], Tuple[int, int]] = {
+            (base, None): (cls.FX_SCALE, to_basis_points(default_tax)),
+        }
+        for currency, entry in data.get("currencies", {}).items():
+            fx = round(entry.get("rate", 1) * cls.FX_SCALE)
+            if fx <= 0:
+                raise ValueError(f"rate for {currency} must be positive")
+            tax_rate = entry.get("tax_rate", default_tax)
+            rates[(currency, None)] = (fx, to_basis_points(tax_rate))
+            for region, region_tax in entry.get("regions", {}).items():
+                rates[(currency, region)] = (fx, to_basis_points(region_tax))
+        return cls(str(data.get("version", "")), base, rates)
+    
+    def lookup(self, currency: str, region: Optional[str] = None) -> Tuple[int, int]:
+        entry = self.rates.get((currency, region))
+        if entry is None:
+            entry = self.rates.get((currency, None))
+            if entry is None:
+                raise ValueError("unsupported currency")
+        return entry
+    
+    def price(
+        self,
+        subtotal: int,
+        discount: int,
+        currency: str,
+        region: Optional[str] = None,
+        rounding: Optional[str] = None,
+    ) -> Tuple[int, int, int, int]:
+        """Переводит суммы из базовой валюты и считает налог региона"""
+        fx, tax_bp = self.lookup(currency, region)
+        rounding = rounding or Rounding.TRUNCATE
+        if fx != self.FX_SCALE:
+            subtotal = divide_rounded(subtotal * fx, self.FX_SCALE, rounding)
+            discount = divide_rounded(discount * fx, self.FX_SCALE, rounding)
+        total_after_discount = max(subtotal - discount, OrderConstants.MIN_TOTAL_AFTER_DISCOUNT)
+        tax = apply_rate_bp(total_after_discount, tax_bp, rounding)
+        return subtotal, discount, tax, total_after_discount + tax
+
+class PricingTable:
+    """
+    Таблица курсов и налогов из локального JSON-файла. Файл читается только при reload(),
+    новый снимок подменяет текущий одной операцией присваивания; последние keep снимков
+    хранятся для отката
+    """
+    
+    def __init__(self, path: str, keep: int = 5):
+        self.path = path
+        self.history: deque = deque(maxlen=keep)
+        self._signature = None
+        self._lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.snapshot: PricingSnapshot = None
+        self.reload(force=True)
+    
+    def reload(self, force: bool = False) -> bool:
+        """Перечитывает файл, если он изменился; возвращает True при смене снимка"""
+        with self._lock:
+            stat = os.stat(self.path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if not force and signature == self._signature:
+                return False
+            with open(self.path, encoding="utf-8") as f:
+                snapshot = PricingSnapshot.from_dict(json.load(f))
+            self._signature = signature
+            self.history.append(snapshot)
+            self.snapshot = snapshot
+            return True
+    
+    def versions(self) -> List[str]:
+        return [snapshot.version for snapshot in self.history]
+    
+    def revisions(self) -> List[Tuple[int, str]]:
+        return [(snapshot.revision, snapshot.version) for snapshot in self.history]
+    
+    def rollback(self, version) -> None:
+        """Откат к снимку из истории: по revision (int) или по version, если она в истории одна"""
+        with self._lock:
+            if isinstance(version, int):
+                matches = [snapshot for snapshot in self.history if snapshot.revision == version]
+            else:
+                matches = [snapshot for snapshot in self.history if snapshot.version == version]
+            if len(matches) > 1:
+                raise ValueError(f"ambiguous pricing version: {version}, roll back by revision")
+            if matches:
+                self.snapshot = matches[0]
+                return
+        raise ValueError(f"unknown pricing version: {version}")
+    
+    def watch(self, interval: float = 1.0) -> None:
+        """Фоновая проверка файла раз в interval секунд"""
+        if self._watcher is not None:
+            return
+        self._stop.clear()
+        
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.reload()
+                except (OSError, ValueError):
+                    logging.getLogger("order_processing").exception("pricing reload failed: %s", self.path)
+        
+        self._watcher = threading.Thread(target=loop, name="pricing-reload", daemon=True)
+        self._watcher.start()
+    
+    def stop(self) -> None:
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+class CheckoutCache:
+    """
+    LRU-кэш расчёта заказа (subtotal, discount, tax, total) с ограничением размера и TTL.
+    Ключ — нормализованная корзина: отсортированные (price, qty), купон и валюта
+    """
+    
+    def __init__(self, maxsize: int = 10000, ttl: Optional[float] = None, clock=time.monotonic):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data: "OrderedDict[Tuple, Tuple[float, Tuple[int, int, int, int]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    @staticmethod
+    def make_key(items: List[Dict], coupon: Optional[str], currency: str, rounding: Optional[str] = None) -> Tuple:
+        # в ключ входит сам объект правила: проверяет доступность купона
+        # и не даёт отдать результат по правилу, заменённому при перезагрузке
+        rule = get_coupon_rule(coupon) if coupon else None
+        return (tuple(sorted((item["price"], item["qty"]) for item in items)), rule, currency, rounding)
+    
+    def get(self, key: Tuple) -> Optional[Tuple[int, int, int, int]]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at and self._clock() >= expires_at:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def put(self, key: Tuple, value: Tuple[int, int, int, int]) -> None:
+        expires_at = self._clock() + self.ttl if self.ttl else 0
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+    
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+    
+    def __len__(self):
+        return len(self._data)
+
+class StageHistogram:
+    """Гистограмма длительностей этапа с фиксированными границами (секунды)"""
+    BUCKETS = (0.000001, 0.000005, 0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+    
+    __slots__ = ("counts", "count", "sum")
+    
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+    
+    def observe(self, value: float) -> None:
+        index = 0
+        for bound in self.BUCKETS:
+            if value <= bound:
+                break
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+class InMemorySink:
+    """Хранит счётчики и гистограммы этапов в памяти"""
+    
+    def __init__(self):
+        self.histograms: Dict[str, StageHistogram] = {}
+        self.alloc_bytes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+    
+    def record(self, stage: str, seconds: float, alloc_bytes: Optional[int]) -> None:
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = StageHistogram()
+            histogram.observe(seconds)
+            if alloc_bytes is not None:
+                self.alloc_bytes[stage] = self.alloc_bytes.get(stage, 0) + alloc_bytes
+    
+    def counters(self) -> Dict[str, int]:
+        return {stage: histogram.count for stage, histogram in self.histograms.items()}
+
+class LoggingSink:
+    """Пишет каждый замер этапа в лог"""
+    
+    def __init__(self, logger: Optional[logging.Logger] = None, level: int = logging.DEBUG):
+        self.logger = logger or logging.getLogger("order_processing.metrics")
+        self.level = level
+    
+    def record(self, stage: str, seconds: float, alloc_bytes: Optional[int]) -> None:
+        self.logger.log(self.level, "checkout stage=%s seconds=%.9f alloc_bytes=%s", stage, seconds, alloc_bytes)
 
-def process_checkout(request: Dict) -> Dict:
+class PrometheusFileSink(InMemorySink):
+    """
+    Накапливает метрики в памяти и выгружает их в текстовом формате Prometheus
+    (для node_exporter textfile collector) каждые flush_every замеров и по flush()
+    """
+    
+    def __init__(self, path: str, flush_every: int = 10000):
+        super().__init__()
+        self.path = path
+        self.flush_every = flush_every
+        self._pending = 0
+        self._flush_lock = threading.Lock()
+    
+    def record(self, stage: str, seconds: float, alloc_bytes: Optional[int]) -> None:
+        super().record(stage, seconds, alloc_bytes)
+        with self._lock:
+            self._pending += 1
+            due = self._pending >= self.flush_every
+            if due:
+                self._pending = 0
+        if due:
+            self.flush()
+    
+    def render(self) -> str:
+        lines = [
+            "# HELP checkout_stage_seconds Duration of process_checkout stages",
+            "# TYPE checkout_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(StageHistogram.BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'checkout_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'checkout_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'checkout_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'checkout_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            if self.alloc_bytes:
+                lines.append("# HELP checkout_stage_alloc_bytes_total Peak bytes allocated by process_checkout stages")
+                lines.append("# TYPE checkout_stage_alloc_bytes_total counter")
+                for stage, total in sorted(self.alloc_bytes.items()):
+                    lines.append(f'checkout_stage_alloc_bytes_total{{stage="{stage}"}} {total}')
+        return "\n".join(lines) + "\n"
+    
+    def flush(self) -> None:
+        """Атомарная запись: уникальный временный файл рядом с path и os.replace"""
+        with self._flush_lock:
+            with self._lock:
+                self._pending = 0
+            text = self.render()
+            directory, name = os.path.split(os.path.abspath(self.path))
+            fd, tmp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+            try:
+                f = open(fd, "w", encoding="utf-8")
+            except BaseException:
+                os.close(fd)
+                os.unlink(tmp_path)
+                raise
+            try:
+                with f:
+                    f.write(text)
+                # mkstemp создаёт файл 0600, а textfile collector обычно читает от другого пользователя
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+                raise
+
+class _StageClock:
+    """
+    Отметки между этапами одного вызова process_checkout: mark(stage) записывает время
+    и выделенную память с предыдущей отметки. Этап, завершившийся исключением, не записывается
+    """
+    __slots__ = ("sink", "trace_allocations", "last", "base")
+    
+    def __init__(self, instrumentation: "CheckoutInstrumentation"):
+        self.sink = instrumentation.sink
+        self.trace_allocations = instrumentation.trace_allocations
+        self._restart()
+    
+    def _restart(self) -> None:
+        if self.trace_allocations:
+            tracemalloc.reset_peak()
+            self.base = tracemalloc.get_traced_memory()[0]
+        self.last = time.perf_counter()
+    
+    def mark(self, stage: str) -> None:
+        seconds = time.perf_counter() - self.last
+        alloc_bytes = None
+        if self.trace_allocations:
+            alloc_bytes = max(tracemalloc.get_traced_memory()[1] - self.base, 0)
+        self.sink.record(stage, seconds, alloc_bytes)
+        self._restart()
+
+class CheckoutInstrumentation:
+    """
+    Замеры этапов process_checkout: parse, validate, cache, subtotal, discount, tax_total, order_id.
+    trace_allocations включает tracemalloc (заметно замедляет обработку)
+    """
+    
+    def __init__(self, sink=None, trace_allocations: bool = False):
+        self.sink = sink if sink is not None else InMemorySink()
+        self.trace_allocations = trace_allocations
+        if trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+    
+    def start(self) -> _StageClock:
+        return _StageClock(self)
+
+def process_checkout(
+    request: Dict,
+    validation: str = ValidationLevel.FULL,
+    cache: Optional[CheckoutCache] = None,
+    instrumentation: Optional[CheckoutInstrumentation] = None,
+    rounding: Optional[str] = None,
+    pricing: Optional[PricingTable] = None,
+) -> Dict:
+    """
+    rounding=None — расчёт со ставками float и усечением int(), как раньше;
+    значение из Rounding включает точную целочисленную арифметику в базисных пунктах.
+    С pricing суммы переводятся из базовой валюты в currency заказа,
+    налог берётся по валюте и необязательному полю region.
+    Использование купона с лимитом засчитывается последним шагом, только для оформленного заказа
+    """
+    # один конвейер для обоих режимов: без инструментирования каждая отметка — одна проверка на None
+    clock = None if instrumentation is None else instrumentation.start()
+    if not isinstance(request, dict):
+        raise ValueError("request must be an object")
     user_id, items, coupon, currency = parse_request(request)
-    currency = validate_request(user_id, items, currency)
+    if clock is not None:
+        clock.mark("parse")
+    currency = validate_request(user_id, items, currency, validation, coupon)
+    if clock is not None:
+        clock.mark("validate")
+    if pricing is None:
+        snapshot = region = None
+    else:
+        snapshot = pricing.snapshot
+        region = request.get("region")
     
-    subtotal = calculate_subtotal(items)
-    discount = calculate_discount(subtotal, coupon)
-    tax, total = calculate_tax_and_total(subtotal, discount)
+    priced = None
+    if cache is not None:
+        key = cache.make_key(items, coupon, currency, rounding)
+        if snapshot is not None:
+            key += (region, snapshot.revision)
+        priced = cache.get(key)
+        if clock is not None:
+            clock.mark("cache")
+    if priced is None:
+        subtotal = calculate_subtotal(items)
+        if clock is not None:
+            clock.mark("subtotal")
+        discount = calculate_discount(subtotal, coupon, rounding)
+        if clock is not None:
+            clock.mark("discount")
+        if snapshot is None:
+            tax, total = calculate_tax_and_total(subtotal, discount, rounding)
+        else:
+            subtotal, discount, tax, total = snapshot.price(subtotal, discount, currency, region, rounding)
+        if clock is not None:
+            clock.mark("tax_total")
+        if cache is not None:
+            cache.put(key, (subtotal, discount, tax, total))
+    else:
+        subtotal, discount, tax, total = priced
+    
+    if coupon:
+        consume_coupon(coupon)
+    order_id = generate_order_id(user_id, len(items))
+    if clock is not None:
+        clock.mark("order_id")
     
     return {
-        "order_id": generate_order_id(user_id, len(items)),
+        "order_id": order_id,
         "user_id": user_id,
         "currency": currency,
         "subtotal": subtotal,
@@ -91,3 +1087,644 @@ def process_checkout(request: Dict) -> Dict:
         "total": total,
         "items_count": len(items),
     }
+
+class LineItem:
+    """Позиция заказа"""
+    __slots__ = ("price", "qty")
+    
+    def __init__(self, price: int, qty: int):
+        self.price = price
+        self.qty = qty
+    
+    @classmethod
+    def from_dict(cls, item: Dict) -> "LineItem":
+        return cls(item.get("price"), item.get("qty"))
+    
+    def to_dict(self) -> Dict:
+        return {"price": self.price, "qty": self.qty}
+    
+    def __eq__(self, other):
+        if not isinstance(other, LineItem):
+            return NotImplemented
+        return self.price == other.price and self.qty == other.qty
+    
+    def __repr__(self):
+        return f"LineItem(price={self.price!r}, qty={self.qty!r})"
+
+class Order:
+    """Заказ: компактное представление запроса на оформление"""
+    __slots__ = ("user_id", "items", "coupon", "currency")
+    
+    def __init__(self, user_id, items: List[LineItem], coupon: Optional[str] = None, currency: Optional[str] = None):
+        self.user_id = user_id
+        self.items = items
+        self.coupon = coupon
+        self.currency = currency
+    
+    @classmethod
+    def from_dict(cls, request: Dict) -> "Order":
+        """Позиции без price/qty или не словари остаются как есть: их опишет find_order_error"""
+        user_id, items, coupon, currency = parse_request(request)
+        if isinstance(items, list):
+            items = [
+                LineItem(item["price"], item["qty"]) if isinstance(item, dict) and "price" in item and "qty" in item else item
+                for item in items
+            ]
+        return cls(user_id, items, coupon, currency)
+    
+    def to_dict(self) -> Dict:
+        return {
+            "user_id": self.user_id,
+            "items": [item.to_dict() if isinstance(item, LineItem) else item for item in self.items],
+            "coupon": self.coupon,
+            "currency": self.currency,
+        }
+    
+    def __repr__(self):
+        return f"Order(user_id={self.user_id!r}, items={len(self.items)}, coupon={self.coupon!r}, currency={self.currency!r})"
+
+class CheckoutResult:
+    """Результат оформления заказа"""
+    __slots__ = ("order_id", "user_id", "currency", "subtotal", "discount", "tax", "total", "items_count")
+    
+    def __init__(self, order_id: str, user_id, currency: str, subtotal: int, discount: int, tax: int, total: int, items_count: int):
+        self.order_id = order_id
+        self.user_id = user_id
+        self.currency = currency
+        self.subtotal = subtotal
+        self.discount = discount
+        self.tax = tax
+        self.total = total
+        self.items_count = items_count
+    
+    @classmethod
+    def from_dict(cls, result: Dict) -> "CheckoutResult":
+        return cls(*(result[name] for name in cls.__slots__))
+    
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+    
+    def __eq__(self, other):
+        if not isinstance(other, CheckoutResult):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+    
+    def __repr__(self):
+        return f"CheckoutResult(order_id={self.order_id!r}, total={self.total!r})"
+
+def find_order_error(order: Order) -> Optional[str]:
+    if order.user_id is None:
+        return "user_id is required"
+    items = order.items
+    if items is None:
+        return "items is required"
+    if not isinstance(items, list):
+        return "items must be a list"
+    if len(items) == 0:
+        return "items must not be empty"
+    if order.coupon is not None and not isinstance(order.coupon, str):
+        return "coupon must be a string"
+    
+    # те же проверки и сообщения, что у find_item_error для словарей
+    for item in items:
+        if not isinstance(item, LineItem):
+            return find_item_error(item) or "item must be an object"
+        price = item.price
+        qty = item.qty
+        if not isinstance(price, _NUMBER_TYPES):
+            return "price must be a number"
+        if not isinstance(qty, _NUMBER_TYPES):
+            return "qty must be a number"
+        if price.__class__ is float and not isfinite(price):
+            return "price must be finite"
+        if qty.__class__ is float and not isfinite(qty):
+            return "qty must be finite"
+        if price <= 0:
+            return "price must be positive"
+        if qty <= 0:
+            return "qty must be positive"
+    
+    return None
+
+def _checkout_valid_order(order: Order, rule: Optional[CouponRule]) -> CheckoutResult:
+    items = order.items
+    subtotal = 0
+    for item in items:
+        subtotal += item.price * item.qty
+    discount = rule(subtotal) if rule is not None else 0
+    tax, total = calculate_tax_and_total(subtotal, discount)
+    currency = order.currency if order.currency is not None else OrderConstants.DEFAULT_CURRENCY
+    
+    return CheckoutResult(
+        generate_order_id(order.user_id, len(items)),
+        order.user_id,
+        currency,
+        subtotal,
+        discount,
+        tax,
+        total,
+        len(items),
+    )
+
+def checkout_order(order: Order) -> CheckoutResult:
+    error = find_order_error(order)
+    if error is not None:
+        raise ValueError(error)
+    rule = get_coupon_rule(order.coupon) if order.coupon else None
+    if rule is not None:
+        consume_coupon(order.coupon)
+    return _checkout_valid_order(order, rule)
+
+def checkout_orders(orders: Iterable[Order]) -> Tuple[List[Optional[CheckoutResult]], List[Tuple[int, str]]]:
+    results: List[Optional[CheckoutResult]] = []
+    errors: List[Tuple[int, str]] = []
+    consume = _coupon_store.consume
+    for index, order in enumerate(orders):
+        error = find_order_error(order)
+        rule = None
+        if error is None and order.coupon:
+            rule = find_coupon_rule(order.coupon)
+            if rule is None or not consume(order.coupon):
+                error = coupon_error(order.coupon)
+        if error is not None:
+            results.append(None)
+            errors.append((index, error))
+            continue
+        results.append(_checkout_valid_order(order, rule))
+    return results, errors
+
+class Cart:
+    """
+    Корзина с пересчётом за O(1): промежуточная сумма поддерживается при каждом изменении,
+    скидка, налог и итог считаются по ней теми же правилами, что и в process_checkout
+    """
+    
+    def __init__(self, coupon: Optional[str] = None, currency: Optional[str] = None, rounding: Optional[str] = None):
+        self._lines: Dict[object, LineItem] = {}
+        self._subtotal = 0
+        self.coupon = coupon
+        self.currency = currency
+        self.rounding = rounding
+    
+    @staticmethod
+    def _check(price: int, qty: int) -> None:
+        if price <= 0:
+            raise ValueError("price must be positive")
+        if qty <= 0:
+            raise ValueError("qty must be positive")
+    
+    def add(self, sku, price: int, qty: int = 1) -> None:
+        """Добавляет qty единиц; для уже лежащего товара меняет цену на новую"""
+        self._check(price, qty)
+        line = self._lines.get(sku)
+        if line is None:
+            self._lines[sku] = LineItem(price, qty)
+            self._subtotal += price * qty
+            return
+        self._subtotal += price * (line.qty + qty) - line.price * line.qty
+        line.price = price
+        line.qty += qty
+    
+    def set_qty(self, sku, qty: int) -> None:
+        line = self._lines.get(sku)
+        if line is None:
+            raise KeyError(sku)
+        if qty == 0:
+            self.remove(sku)
+            return
+        self._check(line.price, qty)
+        self._subtotal += line.price * (qty - line.qty)
+        line.qty = qty
+    
+    def remove(self, sku) -> None:
+        line = self._lines.pop(sku)
+        self._subtotal -= line.price * line.qty
+    
+    @property
+    def subtotal(self) -> int:
+        return self._subtotal
+    
+    def __len__(self):
+        return len(self._lines)
+    
+    def totals(self) -> Dict:
+        if not self._lines:
+            raise ValueError("items must not be empty")
+        subtotal = self._subtotal
+        discount = calculate_discount(subtotal, self.coupon, self.rounding)
+        tax, total = calculate_tax_and_total(subtotal, discount, self.rounding)
+        return {
+            "currency": self.currency if self.currency is not None else OrderConstants.DEFAULT_CURRENCY,
+            "subtotal": subtotal,
+            "discount": discount,
+            "tax": tax,
+            "total": total,
+            "items_count": len(self._lines),
+        }
+    
+    def to_request(self, user_id) -> Dict:
+        return {
+            "user_id": user_id,
+            "items": [line.to_dict() for line in self._lines.values()],
+            "coupon": self.coupon,
+            "currency": self.currency,
+        }
+    
+    def checkout(self, user_id) -> Dict:
+        result = self.totals()
+        if self.coupon:
+            consume_coupon(self.coupon)
+        return {"order_id": generate_order_id(user_id, result["items_count"]), "user_id": user_id, **result}
+
+def calculate_subtotals_columnar(prices, qtys, offsets):
+    """Сегментированная сумма: заказ i занимает позиции offsets[i]:offsets[i + 1]"""
+    starts = offsets[:-1]
+    nonempty = offsets[1:] > starts
+    subtotals = np.zeros(len(starts), dtype=np.int64)
+    if len(prices):
+        subtotals[nonempty] = np.add.reduceat(prices * qtys, starts[nonempty])
+    return subtotals
+
+def calculate_discounts_columnar(subtotals, rules: List[Optional[CouponRule]], rounding: Optional[str] = None):
+    """Скидки по колонкам: заказы группируются по объекту правила, найденному при проверке"""
+    groups: Dict[int, Tuple[CouponRule, List[int]]] = {}
+    for index, rule in enumerate(rules):
+        if rule is not None:
+            group = groups.get(id(rule))
+            if group is None:
+                groups[id(rule)] = (rule, [index])
+            else:
+                group[1].append(index)
+    
+    discounts = np.zeros(len(subtotals), dtype=np.int64)
+    for rule, indexes in groups.values():
+        rows = np.array(indexes)
+        column = subtotals[rows]
+        values = np.asarray(rule.apply_column(column) if rounding is None else rule.apply_column_fixed(column, rounding))
+        if values.dtype.kind != "i":
+            discounts = discounts.astype(np.result_type(discounts, values))
+        discounts[rows] = values
+    
+    return discounts
+
+def calculate_tax_and_total_columnar(subtotals, discounts, rounding: Optional[str] = None):
+    after_discount = np.maximum(subtotals - discounts, OrderConstants.MIN_TOTAL_AFTER_DISCOUNT)
+    if rounding is None:
+        taxes = np.trunc(after_discount * OrderConstants.TAX_RATE).astype(np.int64)
+    else:
+        taxes = divide_rounded_column(after_discount * OrderConstants.TAX_RATE_BP, OrderConstants.BASIS_POINTS, rounding)
+    return taxes, after_discount + taxes
+
+# Верхняя граница промежуточной суммы заказа для int64: запас 2**16 на умножение на ставку в bp
+_COLUMNAR_SUBTOTAL_LIMIT = 2 ** 47
+
+def _checkout_batch_columnar(requests: Iterable[Dict], validation: str, rounding: Optional[str]) -> Tuple[List[Optional[Dict]], List[Tuple[int, str]]]:
+    """
+    Колоночный расчёт на NumPy. Позиции проверяются масками по всему пакету,
+    find_request_error вызывается только для заказов с ошибкой, чтобы сообщения совпадали
+    со скалярным движком. Без NumPy, для нецелых цен и количеств или сумм,
+    которые не помещаются в int64, пакет считает скалярный движок
+    """
+    if np is None:
+        return process_checkout_batch(requests, "scalar", validation, rounding)
+    if validation not in (ValidationLevel.FULL, ValidationLevel.SCHEMA, ValidationLevel.TRUSTED):
+        raise ValueError(f"unknown validation level: {validation}")
+    requests = requests if isinstance(requests, list) else list(requests)
+    check = validation != ValidationLevel.TRUSTED
+    
+    errors: List[Tuple[int, str]] = []
+    find_error = find_request_error
+    
+    accepted: List[Tuple[int, Dict]] = []
+    item_lists: List[List[Dict]] = []
+    for index, request in enumerate(requests):
+        if not isinstance(request, dict):
+            errors.append((index, "request must be an object"))
+            continue
+        items = request.get("items")
+        coupon = request.get("coupon")
+        if check and (request.get("user_id") is None or not isinstance(items, list) or not items
+                      or (coupon is not None and not isinstance(coupon, str))):
+            errors.append((index, find_error(request.get("user_id"), items, validation, coupon)))
+            continue
+        accepted.append((index, request))
+        item_lists.append(items)
+    
+    try:
+        prices = [item["price"] for items in item_lists for item in items]
+        qtys = [item["qty"] for items in item_lists for item in items]
+    except (KeyError, TypeError, IndexError):
+        if not check:
+            raise
+        # в пакете есть позиция без price/qty или не словарь: такие заказы отсеиваются по одному
+        kept = []
+        for (index, request), items in zip(accepted, item_lists):
+            try:
+                for item in items:
+                    item["price"], item["qty"]
+            except (KeyError, TypeError, IndexError):
+                errors.append((index, find_error(request.get("user_id"), items, validation, request.get("coupon"))))
+            else:
+                kept.append(((index, request), items))
+        accepted = [entry for entry, _ in kept]
+        item_lists = [items for _, items in kept]
+        prices = [item["price"] for items in item_lists for item in items]
+        qtys = [item["qty"] for items in item_lists for item in items]
+    lengths = list(map(len, item_lists))
+    
+    price_column = np.array(prices)
+    qty_column = np.array(qtys)
+    length_column = np.array(lengths, dtype=np.int64)
+    if prices and (price_column.dtype.kind != "i" or qty_column.dtype.kind != "i"
+                   or int(np.abs(price_column).max()) * int(np.abs(qty_column).max())
+                   * int(length_column.max()) >= _COLUMNAR_SUBTOTAL_LIMIT):
+        return process_checkout_batch(requests, "scalar", validation, rounding)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(length_column, out=offsets[1:])
+    
+    invalid_rows = set()
+    if validation == ValidationLevel.FULL and prices:
+        invalid_items = np.flatnonzero((price_column <= 0) | (qty_column <= 0))
+        if len(invalid_items):
+            invalid_rows = set((np.searchsorted(offsets, invalid_items, side="right") - 1).tolist())
+    
+    # купоны ищутся после проверки позиций: у некорректного заказа ошибка — его проверка
+    find_rule = find_coupon_rule
+    keep = np.ones(len(accepted), dtype=bool)
+    rules: List[Optional[CouponRule]] = []
+    for row, (index, request) in enumerate(accepted):
+        error = None
+        rule = None
+        if row in invalid_rows:
+            error = find_error(request.get("user_id"), request.get("items"), validation, request.get("coupon"))
+        else:
+            coupon = request.get("coupon")
+            if coupon:
+                rule = find_rule(coupon)
+                if rule is None:
+                    error = coupon_error(coupon)
+        if error is None:
+            rules.append(rule)
+        else:
+            errors.append((index, error))
+            keep[row] = False
+    
+    errors.sort()
+    if len(rules) != len(accepted):
+        accepted = [entry for entry, kept in zip(accepted, keep.tolist()) if kept]
+        item_mask = np.repeat(keep, length_column)
+        price_column = price_column[item_mask]
+        qty_column = qty_column[item_mask]
+        length_column = length_column[keep]
+        offsets = np.zeros(len(length_column) + 1, dtype=np.int64)
+        np.cumsum(length_column, out=offsets[1:])
+    
+    subtotals = calculate_subtotals_columnar(price_column, qty_column, offsets)
+    discounts = calculate_discounts_columnar(subtotals, rules, rounding)
+    if discounts.dtype.kind != "i":
+        return process_checkout_batch(requests, "scalar", validation, rounding)
+    taxes, totals = calculate_tax_and_total_columnar(subtotals, discounts, rounding)
+    
+    results: List[Optional[Dict]] = [None] * len(requests)
+    default_currency = OrderConstants.DEFAULT_CURRENCY
+    order_id = generate_order_id
+    consume = _coupon_store.consume
+    errors_count = len(errors)
+    rows = zip(accepted, subtotals.tolist(), discounts.tolist(), taxes.tolist(), totals.tolist(), length_column.tolist())
+    for (index, request), subtotal, discount, tax, total, items_count in rows:
+        coupon = request.get("coupon")
+        if coupon and not consume(coupon):
+            errors.append((index, coupon_error(coupon)))
+            continue
+        user_id = request["user_id"]
+        currency = request.get("currency")
+        results[index] = {
+            "order_id": order_id(user_id, items_count),
+            "user_id": user_id,
+            "currency": currency if currency is not None else default_currency,
+            "subtotal": subtotal,
+            "discount": discount,
+            "tax": tax,
+            "total": total,
+            "items_count": items_count,
+        }
+    if len(errors) != errors_count:
+        errors.sort()
+    
+    return results, errors
+
+def process_checkout_batch(
+    requests: Iterable[Dict],
+    engine: str = "scalar",
+    validation: str = ValidationLevel.FULL,
+    rounding: Optional[str] = None,
+) -> Tuple[List[Optional[Dict]], List[Tuple[int, str]]]:
+    """
+    Пакетная обработка заказов: results[i] соответствует requests[i]
+    (None для ошибочных), errors содержит пары (индекс, сообщение).
+    engine="columnar" считает все заказы пакета по колонкам на NumPy
+    (необязательная зависимость; без неё результат считает скалярный движок)
+    """
+    if rounding is not None:
+        check_rounding(rounding)
+    if engine == "columnar":
+        return _checkout_batch_columnar(requests, validation, rounding)
+    if engine != "scalar":
+        raise ValueError(f"unknown engine: {engine}")
+    
+    results: List[Optional[Dict]] = []
+    errors: List[Tuple[int, str]] = []
+    append_result = results.append
+    append_error = errors.append
+    
+    default_currency = OrderConstants.DEFAULT_CURRENCY
+    find_rule = find_coupon_rule
+    consume = _coupon_store.consume
+    find_error = find_request_error
+    tax_and_total = calculate_tax_and_total
+    order_id = generate_order_id
+    
+    for index, request in enumerate(requests):
+        if not isinstance(request, dict):
+            append_result(None)
+            append_error((index, "request must be an object"))
+            continue
+        user_id = request.get("user_id")
+        items = request.get("items")
+        coupon = request.get("coupon")
+        error = find_error(user_id, items, validation, coupon)
+        rule = None
+        if error is None:
+            if coupon:
+                rule = find_rule(coupon)
+                if rule is None or not consume(coupon):
+                    error = coupon_error(coupon)
+        if error is not None:
+            append_result(None)
+            append_error((index, error))
+            continue
+        
+        currency = request.get("currency")
+        subtotal = 0
+        for item in items:
+            subtotal += item["price"] * item["qty"]
+        if rule is None:
+            discount = 0
+        elif rounding is None:
+            discount = rule(subtotal)
+        else:
+            discount = rule.fixed(subtotal, rounding)
+        tax, total = tax_and_total(subtotal, discount, rounding)
+        items_count = len(items)
+        
+        append_result({
+            "order_id": order_id(user_id, items_count),
+            "user_id": user_id,
+            "currency": currency if currency is not None else default_currency,
+            "subtotal": subtotal,
+            "discount": discount,
+            "tax": tax,
+            "total": total,
+            "items_count": items_count,
+        })
+    
+    return results, errors
+
+def _install_coupon_store(store: CouponStore) -> None:
+    global _coupon_store
+    _coupon_store = store
+
+def _checkout_chunk(
+    chunk: List[Dict],
+    engine: str,
+    validation: str,
+    rounding: Optional[str],
+) -> Tuple[List[Optional[Dict]], List[Tuple[int, str]]]:
+    return process_checkout_batch(chunk, engine, validation, rounding)
+
+def _unpack_chunk(outcome: Tuple[List[Optional[Dict]], List[Tuple[int, str]]]) -> Iterator[Tuple[Optional[Dict], Optional[str]]]:
+    results, errors = outcome
+    errors_by_index = dict(errors)
+    for index, result in enumerate(results):
+        yield result, errors_by_index.get(index)
+
+def _commit_coupons(chunk: List[Dict], outcome) -> Iterator[Tuple[Optional[Dict], Optional[str]]]:
+    """
+    Воркер считает лимиты купонов по своей копии хранилища, поэтому использования
+    засчитываются ещё раз в хранилище родителя — в порядке входа; не уложившийся в лимит
+    заказ получает ошибку купона
+    """
+    for request, (result, error) in zip(chunk, _unpack_chunk(outcome)):
+        if error is None:
+            coupon = request.get("coupon")
+            if coupon and not _coupon_store.consume(coupon):
+                result, error = None, coupon_error(coupon)
+        yield result, error
+
+def process_checkout_parallel(
+    requests: Iterable[Dict],
+    workers: Optional[int] = None,
+    batch_size: int = 1000,
+    engine: str = "scalar",
+    validation: str = ValidationLevel.FULL,
+    rounding: Optional[str] = None,
+    start_method: Optional[str] = None,
+) -> Iterator[Tuple[Optional[Dict], Optional[str]]]:
+    """
+    Параллельная обработка в пуле процессов. Заказы отправляются пачками по batch_size,
+    в работе одновременно не больше 2 * workers пачек; пары (результат, ошибка)
+    возвращаются в порядке входа. Воркеры получают копию текущего хранилища купонов,
+    а лимиты использований соблюдаются по хранилищу родителя
+    """
+    if batch_size <= 0:
+        raise ValueError("batch_size must be positive")
+    workers = workers or os.cpu_count() or 1
+    context = multiprocessing.get_context(start_method) if start_method else None
+    
+    it = iter(requests)
+    pending = deque()
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=context, initializer=_install_coupon_store, initargs=(_coupon_store,),
+    ) as pool:
+        for chunk in iter(lambda: list(islice(it, batch_size)), []):
+            pending.append((chunk, pool.submit(_checkout_chunk, chunk, engine, validation, rounding)))
+            if len(pending) >= 2 * workers:
+                chunk, future = pending.popleft()
+                yield from _commit_coupons(chunk, future.result())
+        while pending:
+            chunk, future = pending.popleft()
+            yield from _commit_coupons(chunk, future.result())
+
+def _read_requests(lines: Iterable[str]) -> Iterator[Tuple[int, Optional[Dict], Optional[str]]]:
+    for line_no, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            yield line_no, None, f"invalid json: {e}"
+            continue
+        if not isinstance(request, dict):
+            yield line_no, None, "request must be a json object"
+            continue
+        yield line_no, request, None
+
+def stream_checkout(source: Iterable[str], sink: TextIO, chunk_size: int = 1000) -> Tuple[int, int]:
+    """
+    Потоковая обработка NDJSON: в памяти одновременно не больше chunk_size заказов.
+    Для ошибочных строк пишется {"line": N, "error": "..."}; возвращает (успешно, с ошибкой)
+    """
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+    
+    ok = failed = 0
+    dumps = json.dumps
+    rows = _read_requests(source)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        
+        valid = [request for _, request, error in chunk if error is None]
+        results, errors = process_checkout_batch(valid)
+        batch_errors = dict(errors)
+        
+        out = []
+        position = 0
+        for line_no, _, error in chunk:
+            if error is None:
+                result = results[position]
+                error = batch_errors.get(position)
+                position += 1
+            if error is None:
+                out.append(dumps(result))
+                ok += 1
+            else:
+                out.append(dumps({"line": line_no, "error": error}))
+                failed += 1
+        out.append("")
+        sink.write("\n".join(out))
+        sink.flush()
+    
+    return ok, failed
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Обработка заказов из NDJSON")
+    parser.add_argument("input", nargs="?", default="-", help="файл с заказами (по умолчанию stdin)")
+    parser.add_argument("-o", "--output", default="-", help="файл для результатов (по умолчанию stdout)")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="заказов на один сброс вывода")
+    args = parser.parse_args(argv)
+    
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    sink = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        _, failed = stream_checkout(source, sink, args.chunk_size)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
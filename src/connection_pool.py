@@ -0,0 +1,338 @@
+"""
+Object Pool Pattern (Пул объектов)
+Ограниченный набор соединений с БД вместо одного общего Singleton
+"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Optional, Tuple
+
+
+class PoolTimeoutError(Exception):
+    """Свободное соединение не появилось за отведённое время"""
+
+
+class ConnectionPool:
+    """
+    Пул соединений: от min_size до max_size штук, новые создаются лазиво,
+    простаивающие дольше idle_timeout закрываются (но не ниже min_size),
+    перед выдачей соединение проходит health_check
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], object],
+        min_size: int = 1,
+        max_size: int = 10,
+        idle_timeout: float = 300.0,
+        timeout: float = 5.0,
+        health_check: Optional[Callable[[object], None]] = None,
+        close: Optional[Callable[[object], None]] = None,
+    ):
+        if not 0 <= min_size <= max_size or max_size < 1:
+            raise ValueError("expected 0 <= min_size <= max_size and max_size >= 1")
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.health_check = health_check
+        self._close = close or (lambda conn: conn.close())
+        self._idle = deque()  # (соединение, время возврата); справа — самые «тёплые»
+        self._checked_out = set()  # id выданных соединений: защита от двойного release
+        self._async_waiters = deque()  # (цикл событий, future), которые будит release()
+        self._size = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self.created = 0
+        self.evicted = 0
+        self.failed_checks = 0
+        for _ in range(min_size):
+            self._idle.append((self._create(), time.monotonic()))
+            self._size += 1
+
+    def _create(self):
+        conn = self.factory()
+        self.created += 1
+        return conn
+
+    def _discard(self, conn) -> None:
+        try:
+            self._close(conn)
+        except Exception:
+            pass
+
+    def _evict_idle_locked(self, now: float) -> list:
+        expired = []
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            expired.append(self._idle.popleft()[0])
+            self._size -= 1
+            self.evicted += 1
+        return expired
+
+    def _take_locked(self) -> Optional[Tuple[object, bool]]:
+        """(соединение, False) из простаивающих, (None, True) — место под новое, None — пул исчерпан"""
+        if self._idle:
+            return self._idle.pop()[0], False
+        if self._size < self.max_size:
+            self._size += 1
+            return None, True
+        return None
+
+    def _notify_locked(self) -> None:
+        """Освободилось место: будим один поток и одну корутину, занять его успеет кто-то один"""
+        self._condition.notify()
+        while self._async_waiters:
+            loop, waiter = self._async_waiters.popleft()
+            if waiter.done():
+                continue
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+                return
+            except RuntimeError:  # цикл событий уже закрыт
+                continue
+
+    def _prepare(self, conn, create: bool):
+        """Создаёт соединение или проверяет выданное; None — проверка не прошла, нужно взять другое"""
+        if create:
+            try:
+                conn = self._create()
+            except Exception:
+                with self._condition:
+                    self._size -= 1
+                    self._notify_locked()
+                raise
+        elif self.health_check is not None:
+            try:
+                self.health_check(conn)
+            except Exception:
+                self.failed_checks += 1
+                self._discard(conn)
+                with self._condition:
+                    self._size -= 1
+                    self._notify_locked()
+                return None
+        with self._condition:
+            self._checked_out.add(id(conn))
+        return conn
+
+    def acquire(self, timeout: Optional[float] = None):
+        """Выдаёт соединение; PoolTimeoutError, если все заняты дольше timeout"""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._condition:
+                if self._closed:
+                    raise RuntimeError("pool is closed")
+                expired = self._evict_idle_locked(time.monotonic())
+                taken = self._take_locked()
+                while taken is None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeoutError(f"no free connection within {timeout}s")
+                    self._condition.wait(remaining)
+                    if self._closed:
+                        raise RuntimeError("pool is closed")
+                    taken = self._take_locked()
+            for stale in expired:
+                self._discard(stale)
+
+            conn = self._prepare(*taken)
+            if conn is not None:
+                return conn
+
+    def release(self, conn) -> None:
+        with self._condition:
+            if id(conn) not in self._checked_out:
+                raise ValueError("connection is not checked out from this pool")
+            self._checked_out.discard(id(conn))
+            if self._closed:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+                self._notify_locked()
+                return
+        self._discard(conn)
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    async def acquire_async(self, timeout: Optional[float] = None):
+        """
+        Асинхронная выдача: ожидание свободного места — future, который будит release(),
+        поток не занимается. В пуле потоков выполняются только создание соединения и health_check;
+        если корутину отменили в этот момент, соединение вернётся в пул
+        """
+        timeout = self.timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            waiter = None
+            with self._condition:
+                if self._closed:
+                    raise RuntimeError("pool is closed")
+                expired = self._evict_idle_locked(time.monotonic())
+                taken = self._take_locked()
+                if taken is None:
+                    waiter = loop.create_future()
+                    self._async_waiters.append((loop, waiter))
+            for stale in expired:
+                self._discard(stale)
+
+            if waiter is not None:
+                try:
+                    await asyncio.wait_for(waiter, max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    self._forget_waiter(waiter)
+                    raise PoolTimeoutError(f"no free connection within {timeout}s") from None
+                except BaseException:
+                    self._forget_waiter(waiter)
+                    raise
+                continue
+
+            conn, create = taken
+            if not create and self.health_check is None:
+                return self._prepare(conn, create)
+            prepared = loop.run_in_executor(None, self._prepare, conn, create)
+            try:
+                conn = await asyncio.shield(prepared)
+            except asyncio.CancelledError:
+                prepared.add_done_callback(self._release_abandoned)
+                raise
+            if conn is not None:
+                return conn
+
+    def _forget_waiter(self, waiter) -> None:
+        # если release() уже разбудил этого ожидающего, передаём пробуждение следующему
+        with self._condition:
+            for entry in self._async_waiters:
+                if entry[1] is waiter:
+                    self._async_waiters.remove(entry)
+                    break
+            if self._idle or self._size < self.max_size:
+                self._notify_locked()
+
+    def _release_abandoned(self, prepared) -> None:
+        if prepared.cancelled() or prepared.exception() is not None:
+            return
+        conn = prepared.result()
+        if conn is not None:
+            self.release(conn)
+
+    @asynccontextmanager
+    async def connection_async(self, timeout: Optional[float] = None):
+        conn = await self.acquire_async(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def evict_idle(self) -> int:
+        """Закрывает простаивающие соединения сверх min_size; возвращает их число"""
+        with self._condition:
+            expired = self._evict_idle_locked(time.monotonic())
+        for conn in expired:
+            self._discard(conn)
+        return len(expired)
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._condition.notify_all()
+            waiters = list(self._async_waiters)
+            self._async_waiters.clear()
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:
+                pass
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "created": self.created,
+                "evicted": self.evicted,
+                "failed_checks": self.failed_checks,
+            }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _wake(waiter) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def sqlite_pool(path: str = ":memory:", **kwargs) -> ConnectionPool:
+    """Пул соединений SQLite: локальная замена настоящей БД"""
+    def factory():
+        return sqlite3.connect(path, check_same_thread=False)
+
+    def health_check(conn):
+        conn.execute("SELECT 1")
+
+    kwargs.setdefault("health_check", health_check)
+    return ConnectionPool(factory, **kwargs)
+
+
+def demonstrate_connection_pool():
+    """Демонстрация работы Object Pool"""
+    print("\n" + "=" * 60)
+    print("🎯 ДЕМОНСТРАЦИЯ OBJECT POOL (Пул соединений)")
+    print("=" * 60)
+
+    with sqlite_pool(min_size=1, max_size=3, timeout=0.2) as pool:
+        print(f"\n1. Пул создан: {pool.stats()}")
+
+        print("\n2. Четыре потока выполняют запросы одновременно:")
+
+        def worker(n):
+            with pool.connection() as conn:
+                value = conn.execute("SELECT ?", (n,)).fetchone()[0]
+                time.sleep(0.01)
+                print(f"   Поток {n}: результат запроса = {value}")
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        print(f"   Статистика: {pool.stats()}")
+
+        print("\n3. Все соединения заняты — ждём с таймаутом:")
+        held = [pool.acquire() for _ in range(3)]
+        try:
+            pool.acquire(timeout=0.05)
+        except PoolTimeoutError as e:
+            print(f"   ⏱️ {e}")
+        for conn in held:
+            pool.release(conn)
+
+    print("\n" + "=" * 60)
+    print("✅ OBJECT POOL: Соединения переиспользуются, их число ограничено!")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    demonstrate_connection_pool()
@@ -3,8 +3,17 @@ Factory Method Pattern (Фабричный метод)
 Определяет интерфейс для создания объекта
 """
 
+import mmap
+import multiprocessing
+import os
+import stat
+import tempfile
+import time
 from abc import ABC, abstractmethod
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from enum import Enum
+from importlib.metadata import entry_points
 
 
 class DocumentType(Enum):
@@ -16,8 +25,14 @@ class DocumentType(Enum):
 
 class Document(ABC):
     """
-    Абстрактный Продукт: Документ
+    Абстрактный Продукт: Документ.
+    Существующий файл отображается в память (mmap) и доступен через content
+    как memoryview без копирования; запись идёт кусками через буферизованный поток
     """
+    CHUNK_SIZE = 1 << 20
+    filename: str
+    _mmap = None
+    _view = None
     
     @abstractmethod
     def open(self) -> str:
@@ -25,10 +40,118 @@ class Document(ABC):
         pass
     
     @abstractmethod
-    def save(self) -> str:
+    def save(self, data=None) -> str:
         """Сохранить документ"""
         pass
     
+    def _map_file(self) -> bool:
+        """Отображает файл в память; False, если файла ещё нет"""
+        if self._view is not None:
+            return True
+        if not os.path.exists(self.filename):
+            return False
+        with open(self.filename, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                self._view = memoryview(b"")
+            else:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._view = memoryview(self._mmap)
+        return True
+    
+    @property
+    def content(self) -> memoryview:
+        """Содержимое файла без копирования; срезы тоже не копируют данные"""
+        if not self._map_file():
+            raise FileNotFoundError(self.filename)
+        return self._view
+    
+    @property
+    def size(self) -> int:
+        return len(self._view) if self._view is not None else 0
+    
+    def iter_chunks(self, chunk_size: int = None):
+        """Содержимое кусками по chunk_size байт (memoryview)"""
+        chunk_size = chunk_size or self.CHUNK_SIZE
+        view = self.content
+        for offset in range(0, len(view), chunk_size):
+            yield view[offset:offset + chunk_size]
+    
+    def _write_file(self, data) -> int:
+        """
+        Пишет data (байты, memoryview, файл с read() или итерируемое кусков) во временный
+        файл рядом и атомарно подменяет им исходный, сохраняя его права доступа;
+        возвращает число записанных байт
+        """
+        # живые срезы content держат отображение, и подменить файл не получится —
+        # сообщаем об этом до записи, а не после. Собственное содержимое документа
+        # (content или его срез) сначала записывается и только потом освобождается
+        own = data is self._view or data is self._mmap or (
+            isinstance(data, memoryview) and self._mmap is not None and data.obj is self._mmap
+        )
+        if not own:
+            self.close()
+        view = None
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            view = memoryview(data)
+            chunks = (view[i:i + self.CHUNK_SIZE] for i in range(0, len(view), self.CHUNK_SIZE))
+        elif hasattr(data, "read"):
+            chunks = iter(lambda: data.read(self.CHUNK_SIZE), b"")
+        else:
+            chunks = data
+        try:
+            mode = stat.S_IMODE(os.stat(self.filename).st_mode)
+        except FileNotFoundError:
+            mode = 0o644
+        
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(self.filename))
+        written = 0
+        try:
+            try:
+                f = open(fd, "wb", buffering=self.CHUNK_SIZE)
+            except BaseException:
+                os.close(fd)
+                raise
+            with f:
+                for chunk in chunks:
+                    written += f.write(chunk)
+                    del chunk
+            # срезы и вспомогательный view держат отображение; отпускаем их до close()
+            del chunks
+            if view is not None:
+                view.release()
+            self.close()
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, self.filename)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return written
+    
+    def _size_note(self) -> str:
+        return f" ({self.size} байт)" if self._view is not None else ""
+    
+    def close(self) -> None:
+        """Освобождает отображение файла; BufferError, если ещё живы срезы content или iter_chunks()"""
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                self._view = memoryview(self._mmap)
+                raise BufferError(
+                    f"{self.filename}: memoryview slices of content/iter_chunks() are still alive, release them first"
+                ) from None
+            self._mmap = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+    
     @abstractmethod
     def print(self) -> str:
         """Распечатать документ"""
@@ -44,10 +167,14 @@ class PDFDocument(Document):
         self.filename = filename
     
     def open(self) -> str:
-        return f"📄 Открываю PDF документ: {self.filename}"
+        self._map_file()
+        return f"📄 Открываю PDF документ: {self.filename}{self._size_note()}"
     
-    def save(self) -> str:
-        return f"💾 Сохраняю PDF: {self.filename}"
+    def save(self, data=None) -> str:
+        if data is None:
+            return f"💾 Сохраняю PDF: {self.filename}"
+        written = self._write_file(data)
+        return f"💾 Сохраняю PDF: {self.filename} ({written} байт)"
     
     def print(self) -> str:
         return f"🖨️ Печатаю PDF: {self.filename}"
@@ -65,10 +192,14 @@ class WordDocument(Document):
         self.filename = filename
     
     def open(self) -> str:
-        return f"📝 Открываю Word документ: {self.filename}"
+        self._map_file()
+        return f"📝 Открываю Word документ: {self.filename}{self._size_note()}"
     
-    def save(self) -> str:
-        return f"💾 Сохраняю Word: {self.filename}"
+    def save(self, data=None) -> str:
+        if data is None:
+            return f"💾 Сохраняю Word: {self.filename}"
+        written = self._write_file(data)
+        return f"💾 Сохраняю Word: {self.filename} ({written} байт)"
     
     def print(self) -> str:
         return f"🖨️ Печатаю Word: {self.filename}"
@@ -86,10 +217,14 @@ class ExcelDocument(Document):
         self.filename = filename
     
     def open(self) -> str:
-        return f"📊 Открываю Excel документ: {self.filename}"
+        self._map_file()
+        return f"📊 Открываю Excel документ: {self.filename}{self._size_note()}"
     
-    def save(self) -> str:
-        return f"💾 Сохраняю Excel: {self.filename}"
+    def save(self, data=None) -> str:
+        if data is None:
+            return f"💾 Сохраняю Excel: {self.filename}"
+        written = self._write_file(data)
+        return f"💾 Сохраняю Excel: {self.filename} ({written} байт)"
     
     def print(self) -> str:
         return f"🖨️ Печатаю Excel: {self.filename}"
@@ -113,14 +248,59 @@ class DocumentCreator(ABC):
         Бизнес-логика, использующая фабричный метод
         """
         document = self.create_document(filename)
-        steps = [
-            f"1. {document.open()}",
-            f"2. {document.save()}",
-            f"3. {document.print()}"
-        ]
+        try:
+            steps = [
+                f"1. {document.open()}",
+                f"2. {document.save()}",
+                f"3. {document.print()}"
+            ]
+        finally:
+            document.close()
         return steps
 
 
+class DocumentFactory:
+    """
+    Фабрика фабрик: реестр создателей. Каждый создатель строится один раз
+    при регистрации, get_creator — просто поиск в словаре
+    """
+    ENTRY_POINT_GROUP = "factory_method.creators"
+    _creators = {}
+    
+    @classmethod
+    def register(cls, doc_type):
+        """Декоратор класса создателя: @DocumentFactory.register(DocumentType.PDF)"""
+        def decorator(creator_cls):
+            cls._creators[doc_type] = creator_cls()
+            return creator_cls
+        return decorator
+    
+    @classmethod
+    def get_creator(cls, doc_type) -> DocumentCreator:
+        return cls._creators[doc_type]
+    
+    @classmethod
+    def registered_types(cls) -> list:
+        return list(cls._creators)
+    
+    @classmethod
+    def load_entry_points(cls, group: str = ENTRY_POINT_GROUP) -> int:
+        """
+        Регистрирует создателей из установленных пакетов (entry points группы group);
+        имя entry point — значение DocumentType или собственный ключ типа
+        """
+        loaded = 0
+        for entry_point in entry_points(group=group):
+            try:
+                doc_type = DocumentType(entry_point.name)
+            except ValueError:
+                doc_type = entry_point.name
+            cls.register(doc_type)(entry_point.load())
+            loaded += 1
+        return loaded
+
+
+@DocumentFactory.register(DocumentType.PDF)
 class PDFCreator(DocumentCreator):
     """
     Конкретный Создатель для PDF
@@ -133,6 +313,7 @@ class PDFCreator(DocumentCreator):
         return "📄 PDF Creator - специализируется на PDF документах"
 
 
+@DocumentFactory.register(DocumentType.WORD)
 class WordCreator(DocumentCreator):
     """
     Конкретный Создатель для Word
@@ -145,6 +326,7 @@ class WordCreator(DocumentCreator):
         return "📝 Word Creator - специализируется на Word документах"
 
 
+@DocumentFactory.register(DocumentType.EXCEL)
 class ExcelCreator(DocumentCreator):
     """
     Конкретный Создатель для Excel
@@ -157,19 +339,124 @@ class ExcelCreator(DocumentCreator):
         return "📊 Excel Creator - специализируется на Excel документах"
 
 
-class DocumentFactory:
+def _process_chunk(creator: DocumentCreator, filenames: list) -> list:
+    """Обработка пачки документов одного типа; выполняется в рабочем потоке или процессе"""
+    clock = time.perf_counter
+    results = []
+    for filename in filenames:
+        start = clock()
+        try:
+            steps, error = creator.process_document(filename), None
+        except Exception as e:
+            steps, error = None, f"{type(e).__name__}: {e}"
+        results.append((filename, steps, error, clock() - start))
+    return results
+
+
+class TypeStats:
+    """Статистика обработки документов одного типа"""
+    __slots__ = ("processed", "failed", "busy_seconds", "max_latency")
+    
+    def __init__(self):
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.max_latency = 0.0
+    
+    def as_dict(self, wall_seconds: float) -> dict:
+        total = self.processed + self.failed
+        return {
+            "processed": self.processed,
+            "failed": self.failed,
+            "avg_latency_s": self.busy_seconds / total if total else 0.0,
+            "max_latency_s": self.max_latency,
+            "throughput_per_s": total / wall_seconds if wall_seconds else 0.0,
+        }
+
+
+class DocumentPipeline:
     """
-    Фабрика фабрик
+    Массовая обработка потока заданий (DocumentType, filename): задания группируются
+    по типу в пачки по chunk_size и выполняются в пуле потоков или процессов;
+    результаты отдаются по мере готовности.
+    Создатель ищется в DocumentFactory в вызывающем процессе и передаётся в пачке,
+    поэтому рабочие процессы (в том числе при start_method "spawn" и "forkserver")
+    видят и создателей, зарегистрированных во время работы или через entry points;
+    для executor="process" класс создателя должен быть доступен для pickle
+    (объявлен на уровне модуля)
     """
     
-    @staticmethod
-    def get_creator(doc_type: DocumentType) -> DocumentCreator:
-        creators = {
-            DocumentType.PDF: PDFCreator(),
-            DocumentType.WORD: WordCreator(),
-            DocumentType.EXCEL: ExcelCreator()
+    def __init__(self, executor: str = "thread", workers: int = None, chunk_size: int = 64,
+                 start_method: str = None):
+        if executor not in ("thread", "process"):
+            raise ValueError("executor must be 'thread' or 'process'")
+        self.executor = executor
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.start_method = start_method
+        self.stats = {}
+        self.wall_seconds = 0.0
+    
+    def _make_executor(self):
+        if self.executor == "process":
+            context = multiprocessing.get_context(self.start_method) if self.start_method else None
+            return ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return ThreadPoolExecutor(max_workers=self.workers)
+    
+    def run(self, jobs):
+        """
+        Генератор кортежей (doc_type, filename, steps, error) в порядке завершения.
+        wall_seconds обновляется с каждой готовой пачкой, так что report() верен
+        и для частично прочитанного прогона
+        """
+        start = time.perf_counter()
+        buffers = defaultdict(list)
+        pending = {}
+        max_pending = 2 * self.workers
+        
+        def submit(pool, doc_type, filenames):
+            pending[pool.submit(_process_chunk, DocumentFactory.get_creator(doc_type), filenames)] = doc_type
+        
+        def drain(return_when):
+            done, _ = wait(pending, return_when=return_when)
+            for future in done:
+                doc_type = pending.pop(future)
+                stats = self.stats.setdefault(doc_type, TypeStats())
+                results = future.result()
+                for filename, steps, error, seconds in results:
+                    if error is None:
+                        stats.processed += 1
+                    else:
+                        stats.failed += 1
+                    stats.busy_seconds += seconds
+                    stats.max_latency = max(stats.max_latency, seconds)
+                self.wall_seconds = time.perf_counter() - start
+                for filename, steps, error, _ in results:
+                    yield doc_type, filename, steps, error
+        
+        try:
+            with self._make_executor() as pool:
+                for doc_type, filename in jobs:
+                    buffer = buffers[doc_type]
+                    buffer.append(filename)
+                    if len(buffer) >= self.chunk_size:
+                        submit(pool, doc_type, buffer)
+                        buffers[doc_type] = []
+                        if len(pending) >= max_pending:
+                            yield from drain(FIRST_COMPLETED)
+                for doc_type, buffer in buffers.items():
+                    if buffer:
+                        submit(pool, doc_type, buffer)
+                while pending:
+                    yield from drain(FIRST_COMPLETED)
+        finally:
+            self.wall_seconds = time.perf_counter() - start
+    
+    def report(self) -> dict:
+        return {
+            getattr(doc_type, "value", doc_type): stats.as_dict(self.wall_seconds)
+            for doc_type, stats in self.stats.items()
         }
-        return creators[doc_type]
 
 
 def demonstrate_factory_method():
@@ -200,6 +487,14 @@ def demonstrate_factory_method():
     for step in excel_steps:
         print(f"   {step}")
     
+    print("\n4. Пакетная обработка 300 документов в пуле потоков:")
+    jobs = [(doc_type, f"file{i}.{doc_type.value}") for i in range(100) for doc_type in DocumentType]
+    pipeline = DocumentPipeline("thread", workers=4, chunk_size=25)
+    processed = sum(1 for _ in pipeline.run(jobs))
+    print(f"   Обработано документов: {processed}")
+    for doc_type, stats in pipeline.report().items():
+        print(f"   {doc_type}: {stats['processed']} шт., {stats['throughput_per_s']:.0f} док/с")
+    
     print("\n" + "=" * 60)
     print("✅ FACTORY METHOD: Создание объектов без указания конкретных классов!")
     print("=" * 60)
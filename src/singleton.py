@@ -3,58 +3,462 @@ Singleton Pattern (Одиночка)
 Гарантирует, что у класса есть только один экземпляр
 """
 
+import contextvars
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+
+
+class Scope:
+    """Время жизни экземпляра Singleton"""
+    PROCESS = "process"   # один на процесс; после fork() создаётся заново
+    THREAD = "thread"     # свой в каждом потоке
+    CONTEXT = "context"   # свой в каждом contextvars-контексте (задачи asyncio)
+
+
 class SingletonMeta(type):
     """
-    Метакласс для реализации Singleton
+    Потокобезопасный метакласс для реализации Singleton.
+    Готовый экземпляр отдаётся без блокировки; первое создание защищено
+    отдельной блокировкой для каждого класса (double-checked locking).
+    Область жизни задаётся атрибутом класса singleton_scope (см. Scope)
     """
     _instances = {}
+    _locks = {}
+    _locks_guard = threading.Lock()
+    _thread_locals = {}
+    _context_vars = {}
+    _teardown_hooks = []
+    
+    def _lock_for(cls) -> threading.Lock:
+        lock = SingletonMeta._locks.get(cls)
+        if lock is None:
+            with SingletonMeta._locks_guard:
+                lock = SingletonMeta._locks.setdefault(cls, threading.Lock())
+        return lock
     
     def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
-            print(f"🆕 Создаём новый экземпляр {cls.__name__}")
-            cls._instances[cls] = super().__call__(*args, **kwargs)
-        else:
-            print(f"♻️ Используем существующий экземпляр {cls.__name__}")
-        return cls._instances[cls]
+        instance = cls._instances.get(cls)
+        if instance is not None:
+            return instance
+        
+        scope = getattr(cls, "singleton_scope", Scope.PROCESS)
+        if scope == Scope.THREAD:
+            local = cls._scoped_storage(SingletonMeta._thread_locals, threading.local)
+            instance = getattr(local, "instance", None)
+            if instance is None:
+                instance = local.instance = super().__call__(*args, **kwargs)
+            return instance
+        if scope == Scope.CONTEXT:
+            var = cls._scoped_storage(
+                SingletonMeta._context_vars,
+                lambda: contextvars.ContextVar(f"singleton:{cls.__qualname__}", default=None),
+            )
+            instance = var.get()
+            if instance is None:
+                instance = super().__call__(*args, **kwargs)
+                var.set(instance)
+            return instance
+        if scope != Scope.PROCESS:
+            raise ValueError(f"unknown singleton scope: {scope}")
+        
+        with cls._lock_for():
+            instance = cls._instances.get(cls)
+            if instance is None:
+                instance = super().__call__(*args, **kwargs)
+                cls._instances[cls] = instance
+        return instance
+    
+    def _scoped_storage(cls, registry: dict, factory):
+        storage = registry.get(cls)
+        if storage is None:
+            with SingletonMeta._locks_guard:
+                storage = registry.get(cls)
+                if storage is None:
+                    storage = registry[cls] = factory()
+        return storage
+    
+    @staticmethod
+    def add_teardown_hook(hook) -> None:
+        """hook(cls, instance) вызывается для каждого экземпляра, удаляемого через reset()"""
+        SingletonMeta._teardown_hooks.append(hook)
+    
+    @staticmethod
+    def _teardown(cls, instance) -> None:
+        for hook in SingletonMeta._teardown_hooks:
+            hook(cls, instance)
+        close = getattr(instance, "close", None)
+        if callable(close):
+            close()
+    
+    @staticmethod
+    def reset(cls=None, teardown: bool = True) -> None:
+        """
+        Сбрасывает экземпляры класса cls (или всех классов). Экземпляр процесса
+        и экземпляры текущего потока/контекста закрываются через close() и хуки;
+        экземпляры других потоков просто перестают быть доступны
+        """
+        classes = [cls] if cls is not None else list(
+            {*SingletonMeta._instances, *SingletonMeta._thread_locals, *SingletonMeta._context_vars}
+        )
+        for target in classes:
+            doomed = []
+            with target._lock_for():
+                instance = SingletonMeta._instances.pop(target, None)
+                if instance is not None:
+                    doomed.append(instance)
+            local = SingletonMeta._thread_locals.pop(target, None)
+            if local is not None and getattr(local, "instance", None) is not None:
+                doomed.append(local.instance)
+            var = SingletonMeta._context_vars.pop(target, None)
+            if var is not None and var.get() is not None:
+                doomed.append(var.get())
+            if teardown:
+                for instance in doomed:
+                    SingletonMeta._teardown(target, instance)
+    
+    @staticmethod
+    def _after_fork_in_child() -> None:
+        # наследованные от родителя объекты (соединения, файлы) в дочернем процессе
+        # не закрываем — ими всё ещё владеет родитель; просто создадим новые при обращении.
+        # Новые threading.local и ContextVar отрезают и экземпляры потока, вызвавшего fork(),
+        # и значения в его текущем контексте
+        SingletonMeta._instances.clear()
+        SingletonMeta._thread_locals.clear()
+        SingletonMeta._context_vars.clear()
+        SingletonMeta._locks.clear()
+        SingletonMeta._locks_guard = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=SingletonMeta._after_fork_in_child)
+
+
+def benchmark_singleton_contention(threads: int = 8, calls: int = 100000) -> dict:
+    """
+    Замер доступа к Singleton из нескольких потоков: время первого создания
+    и среднее время одного вызова после него
+    """
+    class Probe(metaclass=SingletonMeta):
+        pass
+    
+    start = time.perf_counter()
+    Probe()
+    first_call = time.perf_counter() - start
+    
+    barrier = threading.Barrier(threads + 1)
+    
+    def worker():
+        barrier.wait()
+        for _ in range(calls):
+            Probe()
+    
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    
+    SingletonMeta.reset(Probe, teardown=False)
+    SingletonMeta._locks.pop(Probe, None)
+    return {
+        "threads": threads,
+        "calls": threads * calls,
+        "first_call_s": first_call,
+        "ns_per_call": elapsed / (threads * calls) * 1e9,
+    }
+
+
+# Литералы, идентификаторы в кавычках и комментарии копируются как есть, прочие пробелы схлопываются
+_SQL_VERBATIM_OR_SPACE = re.compile(
+    r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`(?:[^`]|``)*`|\[[^\]]*\]|--[^\n]*\n?|/\*.*?\*/)|\s+""",
+    re.DOTALL,
+)
+
+
+class StatementCache:
+    """
+    LRU-кэш подготовленных запросов с ключом по нормализованному SQL.
+    Нормализованный текст и передаётся в sqlite3: его собственный кэш операторов
+    того же размера ищет по точному тексту, поэтому запросы, отличающиеся лишь
+    пробелами, используют один подготовленный оператор, а hit_rate показывает
+    долю выполнений без повторного разбора
+    """
+    
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # нормализованный SQL, порядок — давность использования
+        self._normalized = {}  # исходный текст -> нормализованный, чтобы не разбирать его повторно
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def normalize(query: str) -> str:
+        """Схлопывает пробелы вне строковых литералов, идентификаторов в кавычках и комментариев"""
+        return _SQL_VERBATIM_OR_SPACE.sub(lambda m: m.group(1) or " ", query).strip()
+    
+    def get(self, query: str) -> str:
+        """Нормализованный SQL для выполнения; учитывает попадание или промах"""
+        sql = self._normalized.get(query)
+        if sql is None:
+            if len(self._normalized) >= 4 * self.maxsize:
+                self._normalized.clear()
+            sql = self._normalized[query] = self.normalize(query)
+        if sql in self._entries:
+            self._entries.move_to_end(sql)
+            self.hits += 1
+            return sql
+        self.misses += 1
+        self._entries[sql] = None
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return sql
+    
+    def __contains__(self, query: str) -> bool:
+        return self.normalize(query) in self._entries
+    
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+    
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate,
+        }
 
 
 class DatabaseConnection(metaclass=SingletonMeta):
     """
-    Пример Singleton: подключение к базе данных
+    Пример Singleton: подключение к базе данных.
+    Строка вида "sqlite://<путь>" подключает настоящую SQLite (":memory:" — в памяти)
     """
-    def __init__(self, connection_string="localhost:5432"):
+    SQLITE_PREFIX = "sqlite://"
+    
+    def __init__(self, connection_string="localhost:5432", statement_cache_size: int = 128):
         self.connection_string = connection_string
         self.is_connected = False
+        self.statements = StatementCache(statement_cache_size)
+        self._connection = None
+        self._lock = threading.Lock()
         print(f"🔌 Инициализация БД: {connection_string}")
     
+    @property
+    def is_sqlite(self) -> bool:
+        return self.connection_string.startswith(self.SQLITE_PREFIX)
+    
     def connect(self):
         """Установка соединения"""
         if not self.is_connected:
+            if self.is_sqlite:
+                self._connection = sqlite3.connect(
+                    self.connection_string[len(self.SQLITE_PREFIX):],
+                    check_same_thread=False,
+                    cached_statements=self.statements.maxsize,
+                )
             self.is_connected = True
             return f"✅ Подключено к {self.connection_string}"
         return "⚠️ Уже подключено"
     
-    def execute(self, query: str) -> str:
-        """Выполнение SQL запроса"""
-        return f"📋 Выполняем: {query}"
+    def close(self):
+        """Закрытие соединения"""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        self.is_connected = False
+    
+    def _require_connection(self):
+        if self._connection is None:
+            raise RuntimeError("call connect() first")
+        return self._connection
+    
+    def execute(self, query: str, params=()):
+        """Выполнение SQL запроса; для SQLite возвращает строки результата"""
+        if not self.is_sqlite:
+            return f"📋 Выполняем: {query}"
+        with self._lock:
+            connection = self._require_connection()
+            sql = self.statements.get(query)
+            with connection:
+                return connection.execute(sql, params).fetchall()
+    
+    def execute_many(self, query: str, params_seq) -> int:
+        """Один запрос для множества наборов параметров в одной транзакции"""
+        if not self.is_sqlite:
+            return sum(1 for _ in params_seq)
+        with self._lock:
+            connection = self._require_connection()
+            sql = self.statements.get(query)
+            with connection:
+                return connection.executemany(sql, params_seq).rowcount
+    
+    def execute_pipeline(self, statements) -> list:
+        """
+        Пачка запросов (query, params) за один захват соединения и одну транзакцию;
+        при ошибке откатывается вся пачка
+        """
+        if not self.is_sqlite:
+            return [f"📋 Выполняем: {query}" for query, _ in statements]
+        with self._lock:
+            connection = self._require_connection()
+            prepared = [(self.statements.get(query), params) for query, params in statements]
+            with connection:
+                return [connection.execute(sql, params).fetchall() for sql, params in prepared]
+
+
+_MISSING = object()
+
+
+class ConfigSnapshot:
+    """
+    Неизменяемая версия конфигурации. Значения только для чтения,
+    ключи с TTL перестают читаться после истечения срока
+    """
+    __slots__ = ("version", "values", "expires")
+    
+    def __init__(self, version: int, values: dict, expires: dict):
+        self.version = version
+        self.values = MappingProxyType(values)
+        self.expires = MappingProxyType(expires)
+    
+    def get(self, key: str, default=None):
+        value = self.values.get(key, _MISSING)
+        if value is _MISSING:
+            return default
+        if self.expires:
+            expires_at = self.expires.get(key)
+            if expires_at is not None and time.monotonic() >= expires_at:
+                return default
+        return value
+    
+    def __getitem__(self, key: str):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+    
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+    
+    def as_dict(self) -> dict:
+        return {key: value for key in self.values if (value := self.get(key, _MISSING)) is not _MISSING}
 
 
 class ConfigManager(metaclass=SingletonMeta):
     """
-    Ещё один пример Singleton: менеджер конфигурации
+    Ещё один пример Singleton: менеджер конфигурации.
+    Чтение идёт из текущего снимка без блокировок; запись собирает новый снимок
+    и публикует его одним присваиванием
     """
     def __init__(self):
-        self.config = {}
+        self._snapshot = ConfigSnapshot(0, {}, {})
+        self._write_lock = threading.Lock()
+        self._subscribers = []
         print("⚙️ Инициализация ConfigManager")
     
-    def set(self, key: str, value):
-        """Установка значения"""
-        self.config[key] = value
-        print(f"📝 Установка: {key} = {value}")
+    @property
+    def config(self):
+        """Текущие значения без истёкших по TTL ключей (только для чтения)"""
+        return MappingProxyType(self._snapshot.as_dict())
+    
+    def snapshot(self) -> ConfigSnapshot:
+        """Согласованная версия конфигурации для серии чтений"""
+        return self._snapshot
     
-    def get(self, key: str):
+    def get(self, key: str, default=None):
         """Получение значения"""
-        return self.config.get(key, None)
+        return self._snapshot.get(key, default)
+    
+    def set(self, key: str, value, ttl: float = None):
+        """Установка значения; ttl — время жизни в секундах"""
+        self.update({key: value}, ttl)
+    
+    def update(self, values: dict, ttl: float = None):
+        """Атомарная установка нескольких значений"""
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._publish(values, (), expires_at)
+    
+    def delete(self, key: str):
+        """Удаление значения"""
+        self._publish({}, (key,), None)
+    
+    def load_file(self, path: str, ttl: float = None):
+        """Загрузка значений из JSON-файла одной версией"""
+        with open(path, encoding="utf-8") as f:
+            self.update(json.load(f), ttl)
+    
+    def purge_expired(self) -> int:
+        """Убирает истёкшие ключи и оповещает о них подписчиков; возвращает их число"""
+        return self._publish({}, (), None)
+    
+    def subscribe(self, callback):
+        """
+        callback(key, old, new) вызывается после публикации каждого изменения, истечение TTL
+        приходит как (key, old, None) при следующей записи или purge_expired(). Исключение
+        подписчика логируется и не мешает остальным подписчикам и записавшему; возвращает отписку
+        """
+        with self._write_lock:
+            self._subscribers = self._subscribers + [callback]
+        
+        def unsubscribe():
+            with self._write_lock:
+                self._subscribers = [s for s in self._subscribers if s is not callback]
+        return unsubscribe
+    
+    def _publish(self, updates: dict, deletions, expires_at) -> int:
+        with self._write_lock:
+            current = self._snapshot
+            now = time.monotonic()
+            values = dict(current.values)
+            expires = {k: t for k, t in current.expires.items() if t > now}
+            
+            changes = []
+            for key, t in current.expires.items():
+                if t <= now and key in values:
+                    old = values.pop(key)
+                    if key not in updates:
+                        changes.append((key, old, None))
+            for key in deletions:
+                if key in values:
+                    changes.append((key, values.pop(key), None))
+                expires.pop(key, None)
+            for key, value in updates.items():
+                old = values.get(key)
+                values[key] = value
+                if expires_at is None:
+                    expires.pop(key, None)
+                else:
+                    expires[key] = expires_at
+                if old != value:
+                    changes.append((key, old, value))
+            
+            if not changes and not updates:
+                return 0
+            self._snapshot = ConfigSnapshot(current.version + 1, values, expires)
+            subscribers = self._subscribers
+        
+        for key, old, new in changes:
+            for callback in subscribers:
+                try:
+                    callback(key, old, new)
+                except Exception:
+                    logging.getLogger("singleton").exception("config subscriber %r failed on %s", callback, key)
+        return len(changes)
 
 
 def demonstrate_singleton():
@@ -79,6 +483,7 @@ def demonstrate_singleton():
     config1 = ConfigManager()
     config1.set("app_name", "MyApp")
     config1.set("version", "1.0.0")
+    print(f"   📝 Установлено: {dict(config1.config)} (версия {config1.snapshot().version})")
     
     config2 = ConfigManager()  # Получим существующий экземпляр
     print(f"   Получаем настройку из config2: {config2.get('app_name')}")
@@ -0,0 +1,115 @@
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "src"))
+
+from connection_pool import ConnectionPool, PoolTimeoutError, sqlite_pool
+
+
+def test_sqlite_pool_reuses_connections():
+    with sqlite_pool(min_size=1, max_size=2) as pool:
+        with pool.connection() as first:
+            assert first.execute("SELECT 1").fetchone() == (1,)
+        with pool.connection() as second:
+            assert second is first
+        assert pool.stats()["created"] == 1 and pool.stats()["in_use"] == 0
+
+
+def test_acquire_times_out_when_exhausted():
+    with sqlite_pool(min_size=0, max_size=1) as pool:
+        held = pool.acquire()
+        with pytest.raises(PoolTimeoutError):
+            pool.acquire(timeout=0.01)
+        pool.release(held)
+        assert pool.stats()["in_use"] == 0
+
+
+def test_double_release_is_rejected():
+    with sqlite_pool(min_size=0, max_size=2) as pool:
+        conn = pool.acquire()
+        pool.release(conn)
+        with pytest.raises(ValueError):
+            pool.release(conn)
+        first, second = pool.acquire(), pool.acquire()
+        assert first is not second
+
+
+def test_failed_health_check_frees_slot_and_notifies():
+    broken = set()
+
+    def health_check(conn):
+        if id(conn) in broken:
+            raise RuntimeError("connection lost")
+
+    with sqlite_pool(min_size=1, max_size=1, health_check=health_check) as pool:
+        conn = pool.acquire()
+        pool.release(conn)
+        broken.add(id(conn))
+        notified = []
+        notify = pool._notify_locked
+        pool._notify_locked = lambda: (notified.append(True), notify())
+        replacement = pool.acquire(timeout=0.1)
+        assert replacement is not conn and notified
+        assert pool.stats()["failed_checks"] == 1 and pool.stats()["size"] == 1
+        pool.release(replacement)
+
+
+def test_acquire_async_timeout_does_not_leak():
+    async def scenario(pool):
+        held = await pool.acquire_async()
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(pool.acquire_async(timeout=5), 0.05)
+        with pytest.raises(PoolTimeoutError):
+            await pool.acquire_async(timeout=0.01)
+        pool.release(held)
+
+    with sqlite_pool(min_size=0, max_size=1) as pool:
+        asyncio.run(scenario(pool))
+        assert pool.stats()["in_use"] == 0
+        pool.release(pool.acquire(timeout=0.1))
+
+
+def test_acquire_async_cancelled_during_creation_returns_connection():
+    created = threading.Event()
+    proceed = threading.Event()
+
+    def factory():
+        created.set()
+        proceed.wait(1)
+        return object()
+
+    async def scenario(pool):
+        task = asyncio.create_task(pool.acquire_async())
+        await asyncio.get_running_loop().run_in_executor(None, created.wait, 1)
+        task.cancel()
+        proceed.set()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        for _ in range(100):
+            if pool.stats()["idle"] == 1:
+                break
+            await asyncio.sleep(0.01)
+
+    pool = ConnectionPool(factory, min_size=0, max_size=1, close=lambda conn: None)
+    asyncio.run(scenario(pool))
+    assert pool.stats() == {"size": 1, "idle": 1, "in_use": 0, "created": 1, "evicted": 0, "failed_checks": 0}
+
+
+def test_acquire_async_waiter_is_woken_by_release():
+    async def scenario(pool):
+        held = await pool.acquire_async()
+        waiting = asyncio.create_task(pool.acquire_async(timeout=2))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        threading.Thread(target=pool.release, args=(held,)).start()
+        conn = await waiting
+        assert conn is held
+        pool.release(conn)
+
+    with sqlite_pool(min_size=0, max_size=1) as pool:
+        asyncio.run(scenario(pool))
+        assert pool.stats()["in_use"] == 0
@@ -0,0 +1,207 @@
+import io
+import os
+import stat
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "src"))
+
+import factory_method
+from factory_method import (
+    DocumentCreator,
+    DocumentFactory,
+    DocumentPipeline,
+    DocumentType,
+    PDFCreator,
+    PDFDocument,
+    WordDocument,
+)
+
+
+class MarkdownDocument(PDFDocument):
+    def __str__(self):
+        return f"MarkdownDocument({self.filename})"
+
+
+class MarkdownCreator(DocumentCreator):
+    def create_document(self, filename: str):
+        return MarkdownDocument(filename)
+
+
+@pytest.fixture
+def registry():
+    saved = dict(DocumentFactory._creators)
+    yield DocumentFactory
+    DocumentFactory._creators.clear()
+    DocumentFactory._creators.update(saved)
+
+
+def test_get_creator_returns_the_registered_instance():
+    creator = DocumentFactory.get_creator(DocumentType.PDF)
+    assert isinstance(creator, PDFCreator)
+    assert DocumentFactory.get_creator(DocumentType.PDF) is creator
+    assert set(DocumentType) <= set(DocumentFactory.registered_types())
+    with pytest.raises(KeyError):
+        DocumentFactory.get_creator("unknown")
+
+
+def test_register_decorator_adds_new_type(registry):
+    decorated = registry.register("markdown")(MarkdownCreator)
+    assert decorated is MarkdownCreator
+    creator = registry.get_creator("markdown")
+    assert isinstance(creator, MarkdownCreator)
+    assert str(creator.create_document("notes.md")) == "MarkdownDocument(notes.md)"
+
+
+def test_load_entry_points(registry, monkeypatch):
+    class EntryPoint:
+        def __init__(self, name, target):
+            self.name = name
+            self._target = target
+
+        def load(self):
+            return self._target
+
+    groups = {}
+
+    def fake_entry_points(group):
+        groups[group] = True
+        return [EntryPoint("markdown", MarkdownCreator), EntryPoint("pdf", MarkdownCreator)]
+
+    monkeypatch.setattr(factory_method, "entry_points", fake_entry_points)
+    assert registry.load_entry_points() == 2
+    assert DocumentFactory.ENTRY_POINT_GROUP in groups
+    assert isinstance(registry.get_creator("markdown"), MarkdownCreator)
+    assert isinstance(registry.get_creator(DocumentType.PDF), MarkdownCreator)
+
+
+def _jobs(count):
+    return [(doc_type, f"file{i}.{doc_type.value}") for i in range(count) for doc_type in DocumentType]
+
+
+def test_pipeline_streams_all_results_with_stats():
+    pipeline = DocumentPipeline("thread", workers=2, chunk_size=7)
+    results = list(pipeline.run(_jobs(20)))
+    assert len(results) == 60 and all(error is None and len(steps) == 3 for _, _, steps, error in results)
+    assert {filename for _, filename, _, _ in results} == {filename for _, filename in _jobs(20)}
+    report = pipeline.report()
+    assert set(report) == {"pdf", "word", "excel"}
+    for stats in report.values():
+        assert stats["processed"] == 20 and stats["failed"] == 0
+        assert stats["throughput_per_s"] > 0 and stats["max_latency_s"] >= stats["avg_latency_s"] > 0
+
+
+def test_pipeline_reports_partial_run():
+    pipeline = DocumentPipeline("thread", workers=1, chunk_size=5)
+    stream = pipeline.run(_jobs(50))
+    next(stream)
+    report = pipeline.report()
+    assert pipeline.wall_seconds > 0
+    assert any(stats["throughput_per_s"] > 0 for stats in report.values())
+    stream.close()
+
+
+def test_pipeline_counts_failures(registry):
+    class Failing(DocumentCreator):
+        def create_document(self, filename):
+            raise OSError(f"cannot open {filename}")
+
+    registry.register("broken")(Failing)
+    pipeline = DocumentPipeline("thread", workers=2, chunk_size=2)
+    results = list(pipeline.run([("broken", "a"), ("broken", "b")]))
+    assert pipeline.report()["broken"]["failed"] == 2
+    assert [error for _, _, _, error in results] == ["OSError: cannot open a", "OSError: cannot open b"]
+
+
+def test_process_pipeline_sees_runtime_registered_creator(registry):
+    registry.register("markdown")(MarkdownCreator)
+    pipeline = DocumentPipeline("process", workers=1, chunk_size=2, start_method="spawn")
+    results = list(pipeline.run([("markdown", "a.md"), ("markdown", "b.md"), (DocumentType.PDF, "c.pdf")]))
+    assert sorted(filename for _, filename, _, _ in results) == ["a.md", "b.md", "c.pdf"]
+    assert all(error is None for _, _, _, error in results)
+    assert pipeline.report()["markdown"]["processed"] == 2
+
+
+def test_document_round_trip_through_mmap(tmp_path):
+    path = tmp_path / "report.pdf"
+    payload = bytes(range(256)) * 40
+    doc = PDFDocument(str(path))
+    assert "10240" in doc.save(payload)
+    with doc:
+        assert "10240" in doc.open()
+        assert isinstance(doc.content, memoryview) and doc.content == payload
+        chunks = list(doc.iter_chunks(4096))
+        assert [len(chunk) for chunk in chunks] == [4096, 4096, 2048]
+        assert b"".join(chunks) == payload
+        del chunks
+    with pytest.raises(FileNotFoundError):
+        PDFDocument(str(tmp_path / "missing.pdf")).content
+
+
+def test_document_saves_streams_and_chunks(tmp_path):
+    source = WordDocument(str(tmp_path / "source.docx"))
+    source.save(io.BytesIO(b"x" * 3000))
+    target = WordDocument(str(tmp_path / "target.docx"))
+    with source:
+        target.save(source.iter_chunks(1000))
+    assert (tmp_path / "target.docx").read_bytes() == b"x" * 3000
+    target.save([b"new ", b"content"])
+    with target:
+        assert bytes(target.content) == b"new content"
+
+
+def test_save_preserves_file_mode(tmp_path):
+    path = tmp_path / "report.pdf"
+    doc = PDFDocument(str(path))
+    doc.save(b"first")
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+    os.chmod(path, 0o640)
+    doc.save(b"second")
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
+
+
+def test_save_with_live_slice_fails_before_writing(tmp_path):
+    path = tmp_path / "report.pdf"
+    doc = PDFDocument(str(path))
+    doc.save(b"original")
+    head = doc.content[:4]
+    with pytest.raises(BufferError, match="release them first"):
+        doc.save(b"replacement")
+    assert path.read_bytes() == b"original"
+    assert os.listdir(tmp_path) == ["report.pdf"]
+    assert bytes(head) == b"orig" and bytes(doc.content) == b"original"
+    head.release()
+    doc.save(b"replacement")
+    assert bytes(doc.content) == b"replacement"
+    doc.close()
+
+
+def test_save_closes_descriptor_when_open_fails(tmp_path, monkeypatch):
+    descriptors = []
+
+    def failing_open(file, *args, **kwargs):
+        descriptors.append(file)
+        raise OSError("no buffers")
+
+    monkeypatch.setattr(factory_method, "open", failing_open, raising=False)
+    with pytest.raises(OSError, match="no buffers"):
+        PDFDocument(str(tmp_path / "report.pdf")).save(b"data")
+    with pytest.raises(OSError):
+        os.fstat(descriptors[0])
+    assert os.listdir(tmp_path) == []
+
+
+def test_save_writes_documents_own_content(tmp_path):
+    path = tmp_path / "report.pdf"
+    doc = PDFDocument(str(path))
+    doc.save(b"x" * 10000)
+    doc.open()
+    assert "10000" in doc.save(doc.content)
+    assert bytes(doc.content) == b"x" * 10000
+    head = doc.content[:4]
+    with pytest.raises(BufferError, match="release them first"):
+        doc.save(head)
+    assert path.read_bytes() == b"x" * 10000 and os.listdir(tmp_path) == ["report.pdf"]
+    head.release()
+    doc.close()
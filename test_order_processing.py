@@ -1,5 +1,57 @@
+import asyncio
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+import tracemalloc
+from functools import partial
+
 import pytest
-from order_processing import process_checkout
+from bench_order_processing import DEFAULT_COUPON_MIX, compare
+from bench_order_processing import main as bench_main
+from bench_order_processing import run as run_benchmarks
+from checkout_diff import ENGINES, REFERENCES, reference, register_engine, run_differential
+from checkout_service import CheckoutCoalescer, make_handler
+from order_processing import (
+    COUPON_RULE_TYPES,
+    Cart,
+    CheckoutCache,
+    CheckoutInstrumentation,
+    CheckoutResult,
+    CouponRule,
+    CouponStore,
+    LineItem,
+    Order,
+    PricingTable,
+    PrometheusFileSink,
+    Rounding,
+    SnowflakeIdGenerator,
+    UlidGenerator,
+    ValidationLevel,
+    apply_rate_bp,
+    calculate_discount,
+    checkout_order,
+    checkout_orders,
+    process_checkout,
+    process_checkout_batch,
+    process_checkout_parallel,
+    register_coupon,
+    register_rule_type,
+    set_coupon_store,
+    set_order_id_generator,
+    stream_checkout,
+    unregister_coupon,
+    validate_batch,
+)
+
+
+def priced(result):
+    """Результат без order_id: id уникален для каждого вызова"""
+    if result is None:
+        return None
+    return {k: v for k, v in result.items() if k != "order_id"}
 
 
 def test_ok_no_coupon():
@@ -23,3 +75,668 @@ def test_ok_save20():
 def test_unknown_coupon():
     with pytest.raises(ValueError):
         process_checkout({"user_id": 1, "items": [{"price": 10, "qty": 1}], "coupon": "???", "currency": "USD"})
+
+
+def test_batch_matches_single_and_collects_errors():
+    requests = [
+        {"user_id": 1, "items": [{"price": 50, "qty": 2}], "coupon": None, "currency": "USD"},
+        {"user_id": 2, "items": [], "coupon": None, "currency": "USD"},
+        {"user_id": 3, "items": [{"price": 100, "qty": 2}], "coupon": "SAVE20"},
+        {"user_id": 4, "items": [{"price": 10, "qty": 1}], "coupon": "???", "currency": "USD"},
+    ]
+    results, errors = process_checkout_batch(requests)
+    assert priced(results[0]) == priced(process_checkout(requests[0]))
+    assert priced(results[2]) == priced(process_checkout(requests[2]))
+    assert results[1] is None and results[3] is None
+    assert errors == [(1, "items must not be empty"), (3, "unknown coupon")]
+
+
+MALFORMED_REQUESTS = [
+    {"user_id": 1, "items": [5]},
+    {"user_id": 2, "items": [{"price": "a", "qty": 1}]},
+    {"user_id": 3, "items": [{"price": 10, "qty": None}]},
+    {"user_id": 4, "items": [{"price": 50, "qty": 2}]},
+]
+MALFORMED_ERRORS = [(0, "item must be an object"), (1, "price must be a number"), (2, "qty must be a number")]
+
+
+@pytest.mark.parametrize("engine", ["scalar", "columnar"])
+def test_batch_reports_malformed_items(engine):
+    results, errors = process_checkout_batch(MALFORMED_REQUESTS, engine=engine)
+    assert errors == MALFORMED_ERRORS
+    assert results[:3] == [None, None, None] and results[3]["total"] == 121
+    _, schema_errors = process_checkout_batch(MALFORMED_REQUESTS, engine=engine, validation=ValidationLevel.SCHEMA)
+    assert schema_errors == MALFORMED_ERRORS
+
+
+@pytest.mark.parametrize("engine", ["scalar", "columnar"])
+@pytest.mark.parametrize("validation", [ValidationLevel.FULL, ValidationLevel.SCHEMA])
+def test_batch_reports_malformed_requests(engine, validation):
+    requests = [
+        ["not", "a", "request"],
+        {"user_id": 1, "items": [{"price": 50, "qty": 2}], "coupon": [1]},
+        {"user_id": 2, "items": [{"price": 50, "qty": 2}], "coupon": {"code": "SAVE10"}},
+        {"user_id": 3, "items": [{"price": 50, "qty": 2}], "coupon": "SAVE10"},
+    ]
+    results, errors = process_checkout_batch(requests, engine=engine, validation=validation)
+    assert errors == [(0, "request must be an object"), (1, "coupon must be a string"), (2, "coupon must be a string")]
+    assert results[:3] == [None, None, None] and results[3]["discount"] == 10
+    assert validate_batch(requests) == [(0, None, "request must be an object"), (1, None, "coupon must be a string"),
+                                        (2, None, "coupon must be a string")]
+    for request in requests[:3]:
+        with pytest.raises(ValueError):
+            process_checkout(request)
+
+
+def test_stream_checkout_reports_malformed_items():
+    out = io.StringIO()
+    lines = [json.dumps(r) + "\n" for r in MALFORMED_REQUESTS]
+    assert stream_checkout(iter(lines), out, chunk_size=10) == (1, 3)
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [row.get("error") for row in rows[:3]] == [error for _, error in MALFORMED_ERRORS]
+    assert rows[3]["total"] == 121
+
+
+def test_stream_checkout_reports_bad_coupons_and_numbers_per_line():
+    lines = [
+        '{"user_id": 1, "items": [{"price": 50, "qty": 2}], "coupon": ["SAVE10"]}\n',
+        '{"user_id": 2, "items": [{"price": 50, "qty": 2}], "coupon": {"code": "VIP"}}\n',
+        '{"user_id": 3, "items": [{"price": NaN, "qty": 1}]}\n',
+        '{"user_id": 4, "items": [{"price": 10, "qty": Infinity}], "coupon": "SAVE10"}\n',
+        '{"user_id": 5, "items": [{"price": 50, "qty": 2}]}\n',
+    ]
+    out = io.StringIO()
+    assert stream_checkout(iter(lines), out, chunk_size=10) == (1, 4)
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [row.get("error") for row in rows] == [
+        "coupon must be a string", "coupon must be a string", "price must be finite", "qty must be finite", None,
+    ]
+    assert [row.get("line") for row in rows[:4]] == [1, 2, 3, 4] and rows[4]["total"] == 121
+
+
+def test_parallel_reports_malformed_items():
+    outcomes = list(process_checkout_parallel(MALFORMED_REQUESTS, workers=2, batch_size=2))
+    assert [error for _, error in outcomes] == [error for _, error in MALFORMED_ERRORS] + [None]
+    assert outcomes[3][0]["total"] == 121
+
+
+def test_columnar_engine_matches_scalar():
+    requests = [
+        {"user_id": u, "items": [{"price": p, "qty": q} for p, q in items], "coupon": c}
+        for u, (items, c) in enumerate([
+            ([(50, 2)], None),
+            ([(30, 3), (7, 1)], "SAVE10"),
+            ([(100, 2)], "SAVE20"),
+            ([(99, 2), (1, 1)], "SAVE20"),
+            ([(60, 1)], "VIP"),
+            ([(100, 1)], "VIP"),
+            ([(5, 1)], "VIP"),
+            ([], None),
+        ])
+    ]
+    columnar, columnar_errors = process_checkout_batch(requests, engine="columnar")
+    scalar, scalar_errors = process_checkout_batch(requests)
+    assert [priced(r) for r in columnar] == [priced(r) for r in scalar]
+    assert columnar_errors == scalar_errors
+
+
+def test_columnar_engine_reuses_rules_found_during_validation():
+    # купон истекает сразу после первой проверки: повторный поиск правила упал бы
+    ticks = iter([1000.0])
+    store = CouponStore({"LAST": {"type": "percentage", "value": 0.5, "ends_at": 2000}}, clock=lambda: next(ticks, 3000.0))
+    previous = set_coupon_store(store)
+    try:
+        results, errors = process_checkout_batch(
+            [{"user_id": 1, "items": [{"price": 40, "qty": 1}], "coupon": "LAST"}], engine="columnar"
+        )
+    finally:
+        set_coupon_store(previous)
+    assert errors == [] and results[0]["discount"] == 20
+
+
+def test_registered_rule_type_and_coupon():
+    @register_rule_type("flat")
+    class FlatRule(CouponRule):
+        __slots__ = ("amount",)
+
+        def __init__(self, rule):
+            self.amount = rule["amount"]
+
+        def __call__(self, subtotal):
+            return self.amount
+
+    register_coupon("FLAT7", {"type": "flat", "amount": 7})
+    try:
+        r = process_checkout({"user_id": 1, "items": [{"price": 50, "qty": 1}], "coupon": "FLAT7"})
+        assert r["discount"] == 7
+        results, _ = process_checkout_batch([{"user_id": 1, "items": [{"price": 50, "qty": 1}], "coupon": "FLAT7"}], engine="columnar")
+        assert results[0]["discount"] == 7
+    finally:
+        unregister_coupon("FLAT7")
+        COUPON_RULE_TYPES.pop("flat")
+
+
+def test_stream_checkout_ndjson():
+    lines = [
+        json.dumps({"user_id": 1, "items": [{"price": 50, "qty": 2}]}) + "\n",
+        "\n",
+        "{not json\n",
+        json.dumps({"user_id": 2, "items": []}) + "\n",
+        json.dumps({"user_id": 3, "items": [{"price": 30, "qty": 3}], "coupon": "SAVE10"}) + "\n",
+    ]
+    out = io.StringIO()
+    assert stream_checkout(iter(lines), out, chunk_size=2) == (2, 2)
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert rows[0]["total"] == 121
+    assert rows[1]["line"] == 3 and rows[1]["error"].startswith("invalid json")
+    assert rows[2] == {"line": 4, "error": "items must not be empty"}
+    assert rows[3]["discount"] == 9
+
+
+def test_parallel_keeps_input_order():
+    requests = [
+        {"user_id": i, "items": [{"price": i % 7, "qty": 1 + i % 3}], "coupon": "SAVE20" if i % 2 else None}
+        for i in range(50)
+    ]
+    results, errors = process_checkout_batch(requests)
+    errors = dict(errors)
+    expected = [(priced(result), errors.get(i)) for i, result in enumerate(results)]
+    parallel = process_checkout_parallel(requests, workers=2, batch_size=4)
+    assert [(priced(result), error) for result, error in parallel] == expected
+
+
+def test_typed_orders_match_dict_pipeline():
+    requests = [
+        {"user_id": 1, "items": [{"price": 50, "qty": 2}], "coupon": "VIP", "currency": "EUR"},
+        {"user_id": 2, "items": [{"price": 10, "qty": 0}]},
+        {"user_id": 3, "items": [{"price": 100, "qty": 2}], "coupon": "SAVE20"},
+    ]
+    orders = [Order.from_dict(r) for r in requests]
+    assert orders[0].items[0] == LineItem(50, 2)
+    assert priced(checkout_order(orders[0]).to_dict()) == priced(process_checkout(requests[0]))
+
+    results, errors = checkout_orders(orders)
+    expected, expected_errors = process_checkout_batch(requests)
+    assert [priced(r and r.to_dict()) for r in results] == [priced(r) for r in expected]
+    assert errors == expected_errors
+    assert CheckoutResult.from_dict(results[2].to_dict()) == results[2]
+
+
+def test_typed_orders_report_malformed_input_like_dicts():
+    requests = MALFORMED_REQUESTS + [
+        {"user_id": 5, "items": [{"price": 50}]},
+        {"user_id": 6, "items": [{"price": float("nan"), "qty": 1}]},
+        {"user_id": 7, "items": [{"price": 50, "qty": 2}], "coupon": ["VIP"]},
+    ]
+    orders = [Order.from_dict(r) for r in requests]
+    results, errors = checkout_orders(orders)
+    expected, expected_errors = process_checkout_batch(requests)
+    assert errors == expected_errors and len(errors) == 6
+    assert [priced(r and r.to_dict()) for r in results] == [priced(r) for r in expected]
+    assert orders[0].to_dict()["items"] == [5]
+    with pytest.raises(ValueError, match="price must be a number"):
+        checkout_order(orders[1])
+
+
+def test_validation_levels():
+    request = {"user_id": 1, "items": [{"price": -5, "qty": 2}]}
+    with pytest.raises(ValueError):
+        process_checkout(request)
+    assert process_checkout(request, validation=ValidationLevel.SCHEMA)["subtotal"] == -10
+    with pytest.raises(ValueError):
+        process_checkout({"user_id": 1, "items": [{"price": 5}]}, validation=ValidationLevel.SCHEMA)
+    assert process_checkout({"user_id": 1, "items": [{"price": 5, "qty": 1}]}, validation=ValidationLevel.TRUSTED)["total"] == 6
+    with pytest.raises(ValueError):
+        process_checkout(request, validation="lenient")
+
+
+def test_validate_batch_reports_every_item():
+    requests = [
+        {"user_id": 1, "items": [{"price": 0, "qty": 1}, {"price": 5, "qty": -1}, {"qty": 1}]},
+        {"user_id": None, "items": []},
+        {"user_id": 3, "items": [{"price": 5, "qty": 1}]},
+    ]
+    assert validate_batch(requests) == [
+        (0, 0, "price must be positive"),
+        (0, 1, "qty must be positive"),
+        (0, 2, "item must have price and qty"),
+        (1, None, "user_id is required"),
+        (1, None, "items must not be empty"),
+    ]
+
+
+def test_checkout_cache_hits_and_fresh_ids():
+    now = [0.0]
+    cache = CheckoutCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    cart = [{"price": 30, "qty": 1}, {"price": 50, "qty": 2}]
+    first = process_checkout({"user_id": 1, "items": cart, "coupon": "SAVE10"}, cache=cache)
+    second = process_checkout({"user_id": 2, "items": cart[::-1], "coupon": "SAVE10", "currency": "USD"}, cache=cache)
+    assert second["user_id"] == 2 and second["order_id"].startswith("2-")
+    assert {k: second[k] for k in ("subtotal", "discount", "tax", "total")} == \
+        {k: first[k] for k in ("subtotal", "discount", "tax", "total")}
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+    process_checkout({"user_id": 1, "items": [{"price": 1, "qty": 1}]}, cache=cache)
+    process_checkout({"user_id": 1, "items": [{"price": 2, "qty": 1}]}, cache=cache)
+    assert cache.stats()["evictions"] == 1 and len(cache) == 2
+
+    now[0] = 11
+    process_checkout({"user_id": 1, "items": [{"price": 2, "qty": 1}]}, cache=cache)
+    assert cache.stats()["expirations"] == 1
+
+
+def test_benchmark_smoke(tmp_path):
+    report = run_benchmarks(orders=10, items=2, coupon_mix=DEFAULT_COUPON_MIX, seed=0, repeat=1)
+    assert {"process_checkout", "process_checkout_batch[columnar]", "calculate_discount[tiered]"} <= set(report["results"])
+    assert all(r["calls"] > 0 and r["ops_per_sec"] > 0 for r in report["results"].values())
+
+    faster = {"results": {name: {**r, "ops_per_sec": r["ops_per_sec"] * 2} for name, r in report["results"].items()}}
+    assert all(row["regression"] for row in compare(report, faster, threshold=0.1))
+    assert not any(row["regression"] for row in compare(report, report, threshold=0.1))
+
+    output = tmp_path / "bench.json"
+    assert bench_main(["--orders", "5", "--repeat", "1", "--only", "parse", "-o", str(output)]) == 0
+    assert list(json.loads(output.read_text())["results"]) == ["parse_request"]
+
+
+def test_instrumentation_records_every_stage(tmp_path):
+    sink = PrometheusFileSink(str(tmp_path / "checkout.prom"), flush_every=100)
+    instrumentation = CheckoutInstrumentation(sink, trace_allocations=True)
+    request = {"user_id": 1, "items": [{"price": 50, "qty": 2}], "coupon": "SAVE10"}
+    try:
+        r = process_checkout(request, instrumentation=instrumentation)
+    finally:
+        tracemalloc.stop()
+    assert r == {**process_checkout(request), "order_id": r["order_id"]}
+    assert sink.counters() == {s: 1 for s in ("parse", "validate", "subtotal", "discount", "tax_total", "order_id")}
+    assert set(sink.alloc_bytes) == set(sink.counters())
+    sink.flush()
+    text = (tmp_path / "checkout.prom").read_text()
+    assert 'checkout_stage_seconds_count{stage="discount"} 1' in text
+
+
+def test_prometheus_sink_flushes_concurrently(tmp_path):
+    path = tmp_path / "checkout.prom"
+    sink = PrometheusFileSink(str(path), flush_every=1)
+    failures = []
+
+    def worker():
+        try:
+            for _ in range(50):
+                sink.record("parse", 0.0001, None)
+        except Exception as e:
+            failures.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    sink.flush()
+    assert failures == []
+    assert 'checkout_stage_seconds_count{stage="parse"} 400' in path.read_text()
+    assert os.listdir(tmp_path) == ["checkout.prom"]
+    assert path.stat().st_mode & 0o777 == 0o644
+
+
+def test_coalescer_batches_concurrent_requests():
+    async def scenario():
+        async with CheckoutCoalescer(max_batch=8, max_delay=0.01) as coalescer:
+            requests = [{"user_id": i, "items": [{"price": 10 * (i + 1), "qty": 1}]} for i in range(20)]
+            requests.append({"user_id": 99, "items": []})
+            outcomes = await asyncio.gather(*(coalescer.submit(r) for r in requests), return_exceptions=True)
+            return requests, outcomes, coalescer.batches
+
+    requests, outcomes, batches = asyncio.run(scenario())
+    assert [o["total"] for o in outcomes[:-1]] == [process_checkout(r)["total"] for r in requests[:-1]]
+    assert isinstance(outcomes[-1], ValueError)
+    assert batches == 3
+
+
+def test_coalescer_survives_a_failing_batch():
+    good = {"user_id": 1, "items": [{"price": 50, "qty": 2}]}
+
+    async def scenario():
+        async with CheckoutCoalescer(max_delay=0.01, timeout=1.0, validation=ValidationLevel.TRUSTED) as coalescer:
+            # без проверок позиция без price роняет process_checkout_batch на всём пакете
+            together = await asyncio.gather(coalescer.submit({"user_id": 1, "items": [{"qty": 1}]}),
+                                            coalescer.submit(good), return_exceptions=True)
+            after = await coalescer.submit(good)
+            return together, after, coalescer._worker.done()
+
+    (bad, first), second, worker_done = asyncio.run(scenario())
+    assert isinstance(bad, KeyError)
+    assert first["total"] == second["total"] == 121
+    assert not worker_done
+
+
+def test_checkout_service_over_unix_socket(tmp_path):
+    path = str(tmp_path / "checkout.sock")
+
+    async def scenario():
+        async with CheckoutCoalescer(max_delay=0.001) as coalescer:
+            server = await asyncio.start_unix_server(make_handler(coalescer), path=path)
+            async with server:
+                reader, writer = await asyncio.open_unix_connection(path)
+                writer.write(b'{"user_id": 1, "items": [{"price": 50, "qty": 2}]}\nnope\n')
+                await writer.drain()
+                lines = [json.loads(await reader.readline()) for _ in range(2)]
+                writer.close()
+                return lines
+
+    first, second = asyncio.run(scenario())
+    assert first["total"] == 121
+    assert "error" in second
+
+
+def test_checkout_service_answers_after_unexpected_error(tmp_path):
+    path = str(tmp_path / "checkout.sock")
+
+    async def scenario():
+        # без проверок позиция без price даёт KeyError, а не ValueError
+        async with CheckoutCoalescer(max_delay=0.001, validation=ValidationLevel.TRUSTED) as coalescer:
+            server = await asyncio.start_unix_server(make_handler(coalescer, pipeline_depth=1), path=path)
+            async with server:
+                reader, writer = await asyncio.open_unix_connection(path)
+                writer.write(b'{"user_id": 1, "items": [{"qty": 1}]}\n'
+                             b'{"user_id": 1, "items": [{"price": 50, "qty": 2}]}\n')
+                await writer.drain()
+                lines = [json.loads(await asyncio.wait_for(reader.readline(), 2)) for _ in range(2)]
+                writer.close()
+                return lines
+
+    bad, good = asyncio.run(scenario())
+    assert bad["error"].startswith("KeyError")
+    assert good["total"] == 121
+
+
+def test_apply_rate_bp_rounding_policies():
+    # 15 * 1000 bp = 1.5, -15 * 1000 bp = -1.5, 25 * 1000 bp = 2.5
+    assert [apply_rate_bp(15, 1000, r) for r in (Rounding.TRUNCATE, Rounding.FLOOR, Rounding.CEIL)] == [1, 1, 2]
+    assert [apply_rate_bp(-15, 1000, r) for r in (Rounding.TRUNCATE, Rounding.FLOOR, Rounding.CEIL)] == [-1, -2, -1]
+    assert [apply_rate_bp(n, 1000, Rounding.HALF_UP) for n in (15, 25, -15)] == [2, 3, -2]
+    assert [apply_rate_bp(n, 1000, Rounding.HALF_EVEN) for n in (15, 25, -15, 16)] == [2, 2, -2, 2]
+    with pytest.raises(ValueError):
+        apply_rate_bp(15, 1000, "nearest")
+    # неизвестная политика отклоняется и тогда, когда результат не попадает на половину
+    for subtotal in (95, 96):
+        with pytest.raises(ValueError, match="unknown rounding"):
+            calculate_discount(subtotal, "SAVE10", rounding="bogus")
+    with pytest.raises(ValueError, match="unknown rounding"):
+        calculate_discount(150, "VIP", rounding="bogus")
+    with pytest.raises(ValueError, match="unknown rounding"):
+        process_checkout_batch([{"user_id": 1, "items": [{"price": 10, "qty": 1}]}], rounding="bogus")
+
+
+def test_fixed_point_mode_in_all_paths():
+    # 0.29 is not exact in binary: int(100 * 0.29) == 28, fixed point gives exactly 29
+    register_coupon("SAVE29", {"type": "percentage", "value": 0.29})
+    try:
+        request = {"user_id": 1, "items": [{"price": 100, "qty": 1}], "coupon": "SAVE29"}
+        assert process_checkout(request)["discount"] == 28
+        fixed = process_checkout(request, rounding=Rounding.TRUNCATE)
+        assert (fixed["discount"], fixed["tax"], fixed["total"]) == (29, 14, 85)
+
+        requests = [request, {"user_id": 2, "items": [{"price": 99, "qty": 3}], "coupon": "SAVE20"}]
+        for engine in ("scalar", "columnar"):
+            results, _ = process_checkout_batch(requests, engine=engine, rounding=Rounding.HALF_EVEN)
+            assert [r["total"] for r in results] == [
+                process_checkout(r, rounding=Rounding.HALF_EVEN)["total"] for r in requests
+            ]
+    finally:
+        unregister_coupon("SAVE29")
+
+
+def test_pricing_table_converts_and_hot_reloads(tmp_path):
+    path = tmp_path / "pricing.json"
+    path.write_text(json.dumps({
+        "version": "v1",
+        "base_currency": "USD",
+        "currencies": {"EUR": {"rate": 0.5, "tax_rate": 0.19, "regions": {"LU": 0.17}}},
+    }))
+    table = PricingTable(str(path))
+    request = {"user_id": 1, "items": [{"price": 100, "qty": 2}], "coupon": "SAVE20", "currency": "EUR"}
+    r = process_checkout(request, pricing=table)
+    assert (r["currency"], r["subtotal"], r["discount"], r["tax"], r["total"]) == ("EUR", 100, 20, 15, 95)
+    assert process_checkout({**request, "region": "LU"}, pricing=table)["tax"] == 13
+    usd = {**request, "currency": "USD"}
+    assert process_checkout(usd, pricing=table)["total"] == process_checkout(usd)["total"]
+    with pytest.raises(ValueError):
+        process_checkout({**request, "currency": "JPY"}, pricing=table)
+
+    assert not table.reload()
+    path.write_text(json.dumps({"version": "v2", "currencies": {"EUR": {"rate": 0.25}}}))
+    os.utime(path, ns=(1, 1))
+    assert table.reload()
+    assert table.versions() == ["v1", "v2"]
+    assert process_checkout(request, pricing=table)["subtotal"] == 50
+    table.rollback("v1")
+    assert process_checkout(request, pricing=table)["subtotal"] == 100
+
+
+def test_cached_pricing_follows_reload_with_same_version(tmp_path):
+    path = tmp_path / "pricing.json"
+    path.write_text(json.dumps({"currencies": {"EUR": {"rate": 0.5}}}))
+    table = PricingTable(str(path))
+    cache = CheckoutCache()
+    request = {"user_id": 1, "items": [{"price": 100, "qty": 1}], "currency": "EUR"}
+    assert process_checkout(request, cache=cache, pricing=table)["subtotal"] == 50
+
+    path.write_text(json.dumps({"currencies": {"EUR": {"rate": 0.25}}}))
+    os.utime(path, ns=(1, 1))
+    assert table.reload() and table.versions() == ["", ""]
+    assert process_checkout(request, cache=cache, pricing=table)["subtotal"] == 25
+
+    with pytest.raises(ValueError, match="ambiguous"):
+        table.rollback("")
+    first_revision = table.revisions()[0][0]
+    table.rollback(first_revision)
+    assert table.snapshot.revision == first_revision
+    assert process_checkout(request, cache=cache, pricing=table)["subtotal"] == 50
+
+
+def test_order_ids_are_unique_across_threads():
+    generator = SnowflakeIdGenerator(worker_id=7)
+    ids = []
+
+    def worker():
+        ids.extend(generator() for _ in range(5000))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(ids)) == len(ids) == 20000
+    assert all((i >> 12) & 0x3FF == 7 for i in ids)
+
+    with pytest.raises(TypeError):
+        SnowflakeIdGenerator()
+    with pytest.raises(ValueError):
+        SnowflakeIdGenerator(worker_id=1024)
+
+    # без настроенного worker_id process_checkout использует ULID
+    first = process_checkout({"user_id": 1, "items": [{"price": 5, "qty": 1}]})
+    second = process_checkout({"user_id": 1, "items": [{"price": 5, "qty": 1}]})
+    assert first["order_id"] != second["order_id"]
+    assert first["order_id"].startswith("1-1-") and len(first["order_id"]) == 4 + 26
+
+
+def test_ulid_generator_is_monotonic():
+    generator = UlidGenerator()
+    previous = set_order_id_generator(generator)
+    try:
+        ids = [generator() for _ in range(1000)]
+        assert ids == sorted(ids) and len(set(ids)) == 1000
+        assert all(len(i) == 26 for i in ids)
+        assert all(set(i) <= set(UlidGenerator.ALPHABET) and i[0] in "01234567" for i in ids)
+        assert len(process_checkout({"user_id": 1, "items": [{"price": 5, "qty": 1}]})["order_id"]) == 30
+    finally:
+        set_order_id_generator(previous)
+
+
+def test_ulid_cached_prefix_matches_full_encoding(monkeypatch):
+    generator = UlidGenerator()
+
+    def full_encoding():
+        value = (generator._last_ms << UlidGenerator.RANDOM_BITS) | generator._random
+        return "".join(UlidGenerator._PAIRS[(value >> shift) & 1023] for shift in UlidGenerator._SHIFTS)
+
+    monkeypatch.setattr(time, "time_ns", lambda: 1_700_000_000_000 * 1_000_000)
+    ids = []
+    for _ in range(100):
+        ids.append(generator())
+        assert ids[-1] == full_encoding()
+    # перенос из младших 20 бит меняет кэшированную часть
+    generator._random |= UlidGenerator._LOW_MASK
+    ids.append(generator())
+    assert ids[-1] == full_encoding() and generator._random & UlidGenerator._LOW_MASK == 0
+    # переполнение 80 бит переходит на следующую миллисекунду
+    generator._random = (1 << UlidGenerator.RANDOM_BITS) - 1
+    ids.append(generator())
+    assert ids[-1] == full_encoding() and generator._last_ms == 1_700_000_000_001
+    assert ids == sorted(ids) and len(set(ids)) == len(ids)
+
+
+def test_coupon_store_reload_windows_and_limits(tmp_path):
+    now = [1000.0]
+    path = tmp_path / "coupons.json"
+    path.write_text(json.dumps({"coupons": {
+        "SPRING": {"type": "percentage", "value": 0.5, "starts_at": 900, "ends_at": 2000},
+        "ONCE": {"type": "fixed_conditional", "value": 5, "fallback": 5, "min_for_value": 0, "usage_limit": 1},
+    }}))
+    store = CouponStore(clock=lambda: now[0])
+    store.load_json(str(path))
+    previous = set_coupon_store(store)
+    try:
+        request = {"user_id": 1, "items": [{"price": 10, "qty": 1}], "coupon": "SPRING"}
+        assert process_checkout(request)["discount"] == 5
+        with pytest.raises(ValueError, match="unknown coupon"):
+            process_checkout({**request, "coupon": "SAVE10"})
+
+        assert store.redeem("ONCE") and not store.redeem("ONCE")
+        _, errors = process_checkout_batch([{**request, "coupon": "ONCE"}])
+        assert errors == [(0, "coupon usage limit reached")]
+
+        now[0] = 2000.0
+        with pytest.raises(ValueError, match="coupon expired"):
+            process_checkout(request, cache=CheckoutCache())
+
+        path.write_text(json.dumps({"coupons": {"SPRING": {"type": "percentage", "value": 0.1}}}))
+        os.utime(path, ns=(1, 1))
+        assert store.reload() and len(store) == 1
+        assert process_checkout(request)["discount"] == 1
+    finally:
+        set_coupon_store(previous)
+
+
+@pytest.mark.parametrize("path", ["process_checkout", "scalar", "columnar", "typed", "cart"])
+def test_usage_limit_is_enforced_on_checkout(path):
+    store = CouponStore({"TWICE": {"type": "percentage", "value": 0.1, "usage_limit": 2}})
+    previous = set_coupon_store(store)
+    request = {"user_id": 1, "items": [{"price": 100, "qty": 1}], "coupon": "TWICE"}
+    try:
+        if path == "process_checkout":
+            process_checkout(request)
+            process_checkout(request)
+            with pytest.raises(ValueError, match="coupon usage limit reached"):
+                process_checkout(request)
+        elif path == "typed":
+            _, errors = checkout_orders([Order.from_dict(request)] * 3)
+            assert errors == [(2, "coupon usage limit reached")]
+        elif path == "cart":
+            cart = Cart(coupon="TWICE")
+            cart.add("a", 100)
+            cart.checkout(1)
+            cart.checkout(1)
+            with pytest.raises(ValueError, match="coupon usage limit reached"):
+                cart.checkout(1)
+        else:
+            results, errors = process_checkout_batch([request, {**request, "items": []}, request, request], engine=path)
+            assert errors == [(1, "items must not be empty"), (3, "coupon usage limit reached")]
+            assert results[0]["discount"] == results[2]["discount"] == 10
+    finally:
+        set_coupon_store(previous)
+    assert store.usage("TWICE") == 2
+
+
+@pytest.mark.parametrize("start_method", ["fork", "spawn"])
+def test_parallel_enforces_usage_limit_in_parent_store(start_method):
+    store = CouponStore({"TWICE": {"type": "percentage", "value": 0.1, "usage_limit": 2}})
+    previous = set_coupon_store(store)
+    request = {"user_id": 1, "items": [{"price": 100, "qty": 1}], "coupon": "TWICE"}
+    try:
+        outcomes = list(process_checkout_parallel([request] * 8, workers=4, batch_size=2, start_method=start_method))
+    finally:
+        set_coupon_store(previous)
+    assert [error for _, error in outcomes] == [None, None] + ["coupon usage limit reached"] * 6
+    assert outcomes[0][0]["discount"] == outcomes[1][0]["discount"] == 10
+    assert store.usage("TWICE") == 2
+
+
+def test_coupon_store_reads_naive_timestamps_as_utc():
+    store = CouponStore({"NEWYEAR": {"type": "percentage", "value": 0.1, "starts_at": "2030-01-01T00:00:00"}})
+    assert store._index["NEWYEAR"].starts_at == 1893456000.0
+
+
+def test_coupon_store_loads_sqlite(tmp_path):
+    path = str(tmp_path / "coupons.db")
+    with sqlite3.connect(path) as connection:
+        connection.execute("CREATE TABLE coupons (code TEXT PRIMARY KEY, rule TEXT, starts_at REAL, ends_at REAL, usage_limit INTEGER)")
+        connection.execute("INSERT INTO coupons VALUES ('HALF', '{\"type\": \"percentage\", \"value\": 0.5}', NULL, NULL, NULL)")
+    connection.close()
+    store = CouponStore()
+    store.load_sqlite(path)
+    assert "HALF" in store and store.find("HALF")(100) == 50
+    with pytest.raises(ValueError, match="invalid table name"):
+        store.load_sqlite(path, table="coupons; DROP TABLE coupons")
+
+
+def test_cart_matches_full_recompute():
+    cart = Cart(coupon="SAVE20")
+    cart.add("a", 90)
+    cart.add("b", 20, 3)
+    cart.add("a", 95, 1)
+    cart.set_qty("b", 2)
+    cart.add("c", 7, 4)
+    cart.remove("c")
+    for coupon in (None, "SAVE10", "SAVE20", "VIP"):
+        cart.coupon = coupon
+        full = process_checkout(cart.to_request(user_id=5))
+        assert cart.totals() == {k: v for k, v in full.items() if k not in ("order_id", "user_id")}
+        assert priced(cart.checkout(5)) == priced(full)
+    cart.set_qty("b", 0)
+    assert len(cart) == 1 and cart.subtotal == 190
+    with pytest.raises(ValueError):
+        cart.add("d", 0)
+
+
+def test_fast_paths_match_reference():
+    assert {"cached", "batch[scalar,half_even]", "batch[columnar,ceil]"} <= set(ENGINES)
+    assert run_differential(cases=1500, seed=17) is None
+
+
+def test_differential_uses_engine_reference():
+    @register_engine("floor-as-ceil", reference=partial(reference, rounding=Rounding.CEIL))
+    def floor_as_ceil(requests):
+        return ENGINES[f"batch[scalar,{Rounding.FLOOR}]"](requests)
+
+    try:
+        divergence = run_differential(cases=300, seed=2, engines=["floor-as-ceil"])
+        assert divergence is not None and divergence["engine"] == "floor-as-ceil"
+    finally:
+        ENGINES.pop("floor-as-ceil")
+        REFERENCES.pop("floor-as-ceil")
+
+
+def test_differential_reports_first_divergence():
+    @register_engine("broken")
+    def broken(requests):
+        return [(None, "boom") for _ in requests]
+
+    try:
+        divergence = run_differential(cases=10, seed=1, engines=["broken"])
+        assert divergence["engine"] == "broken" and divergence["index"] == 0
+        assert divergence["actual"] == (None, "boom")
+    finally:
+        ENGINES.pop("broken")
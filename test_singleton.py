@@ -0,0 +1,234 @@
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "src"))
+
+from singleton import ConfigManager, DatabaseConnection, Scope, SingletonMeta, StatementCache, benchmark_singleton_contention
+
+
+def test_concurrent_first_calls_build_one_instance():
+    class Slow(metaclass=SingletonMeta):
+        created = 0
+
+        def __init__(self):
+            Slow.created += 1
+            time.sleep(0.01)
+
+    barrier = threading.Barrier(16)
+    instances = []
+
+    def worker():
+        barrier.wait()
+        instances.append(Slow())
+
+    threads = [threading.Thread(target=worker) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    try:
+        assert Slow.created == 1
+        assert len(instances) == 16 and all(instance is instances[0] for instance in instances)
+    finally:
+        SingletonMeta.reset(Slow, teardown=False)
+
+
+def test_benchmark_singleton_contention():
+    stats = benchmark_singleton_contention(threads=4, calls=1000)
+    assert stats["threads"] == 4 and stats["calls"] == 4000
+    assert stats["ns_per_call"] > 0 and stats["first_call_s"] > 0
+    assert not any(cls.__name__ == "Probe" for cls in SingletonMeta._instances)
+
+
+@pytest.fixture
+def sqlite_db():
+    SingletonMeta.reset(DatabaseConnection)
+    db = DatabaseConnection("sqlite://:memory:", statement_cache_size=4)
+    db.connect()
+    db.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, value TEXT)")
+    yield db
+    SingletonMeta.reset(DatabaseConnection)
+
+
+def test_statement_cache_keeps_literals_and_comments():
+    assert StatementCache.normalize("SELECT  *\n FROM t\tWHERE v = 'a    b\n c'") == "SELECT * FROM t WHERE v = 'a    b\n c'"
+    assert StatementCache.normalize('SELECT "my  col" FROM [x  y]') == 'SELECT "my  col" FROM [x  y]'
+    assert StatementCache.normalize("SELECT 'it''s   ok'") == "SELECT 'it''s   ok'"
+    assert StatementCache.normalize("SELECT 1 -- one\n   , 2") == "SELECT 1 -- one\n , 2"
+
+
+def test_string_literal_round_trips(sqlite_db):
+    sqlite_db.execute("INSERT INTO t (value) VALUES ('a    b\n c')")
+    assert sqlite_db.execute("SELECT value FROM t") == [("a    b\n c",)]
+
+
+def test_statement_cache_is_keyed_by_normalized_sql(sqlite_db):
+    before = sqlite_db.statements.stats()
+    sqlite_db.execute("SELECT value FROM t WHERE id = ?", (1,))
+    sqlite_db.execute("SELECT value\n  FROM t   WHERE id = ?", (1,))
+    stats = sqlite_db.statements.stats()
+    assert stats["misses"] - before["misses"] == 1 and stats["hits"] - before["hits"] == 1
+    for n in range(5):
+        sqlite_db.execute(f"SELECT {n}")
+    assert sqlite_db.statements.stats()["evictions"] >= 1
+    assert "SELECT value FROM t WHERE id = ?" not in sqlite_db.statements
+
+
+def test_execute_many_and_pipeline(sqlite_db):
+    assert sqlite_db.execute_many("INSERT INTO t (value) VALUES (?)", [("x",), ("y",), ("z",)]) == 3
+    results = sqlite_db.execute_pipeline([
+        ("UPDATE t SET value = ? WHERE id = ?", ("w", 1)),
+        ("SELECT value FROM t ORDER BY id", ()),
+    ])
+    assert results == [[], [("w",), ("y",), ("z",)]]
+    with pytest.raises(Exception):
+        sqlite_db.execute_pipeline([
+            ("DELETE FROM t", ()),
+            ("SELECT * FROM missing", ()),
+        ])
+    assert sqlite_db.execute("SELECT COUNT(*) FROM t") == [(3,)]
+
+
+@pytest.fixture
+def config():
+    SingletonMeta.reset(ConfigManager)
+    yield ConfigManager()
+    SingletonMeta.reset(ConfigManager)
+
+
+def test_config_snapshot_is_immutable_and_versioned(config):
+    config.update({"a": 1, "b": 2})
+    snapshot = config.snapshot()
+    config.set("a", 10)
+    assert snapshot["a"] == 1 and snapshot.version + 1 == config.snapshot().version
+    assert config.get("a") == 10 and config.snapshot().as_dict() == {"a": 10, "b": 2}
+    with pytest.raises(TypeError):
+        config.config["a"] = 3
+    config.delete("b")
+    assert "b" not in config.snapshot() and config.get("b", "gone") == "gone"
+
+
+def test_config_ttl_expires_and_notifies(config):
+    changes = []
+    config.subscribe(lambda *change: changes.append(change))
+    config.set("token", "abc", ttl=0)
+    assert "token" not in config.config and dict(config.config) == {}
+    config.set("region", "eu", ttl=60)
+    assert config.get("token") is None and "token" not in config.snapshot()
+    assert config.config["region"] == "eu"
+    assert config.get("region") == "eu"
+    assert ("token", "abc", None) in changes
+    changes.clear()
+    config.set("token", "def", ttl=0)
+    assert config.purge_expired() == 1
+    assert changes == [("token", None, "def"), ("token", "def", None)]
+    assert config.purge_expired() == 0
+
+
+def test_config_subscriber_errors_are_isolated(config, caplog):
+    seen = []
+
+    def broken(key, old, new):
+        raise RuntimeError("subscriber bug")
+
+    config.subscribe(broken)
+    unsubscribe = config.subscribe(lambda *change: seen.append(change))
+    with caplog.at_level(logging.ERROR, logger="singleton"):
+        config.set("mode", "fast")
+    assert seen == [("mode", None, "fast")] and config.get("mode") == "fast"
+    assert "subscriber bug" in caplog.text
+    unsubscribe()
+    config.set("mode", "safe")
+    assert seen == [("mode", None, "fast")]
+
+
+def test_config_load_file_publishes_one_version(config, tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({"host": "db", "port": 5432}), encoding="utf-8")
+    version = config.snapshot().version
+    config.load_file(str(path), ttl=60)
+    assert config.snapshot().version == version + 1
+    assert config.snapshot().as_dict() == {"host": "db", "port": 5432}
+
+
+def _scoped(scope):
+    class Resource(metaclass=SingletonMeta):
+        singleton_scope = scope
+
+        def __init__(self):
+            self.closed = False
+
+        def close(self):
+            self.closed = True
+
+    return Resource
+
+
+def test_thread_scope_gives_each_thread_its_own_instance():
+    Resource = _scoped(Scope.THREAD)
+    main = Resource()
+    other = []
+    thread = threading.Thread(target=lambda: other.append((Resource(), Resource())))
+    thread.start()
+    thread.join()
+    try:
+        assert Resource() is main
+        assert other[0][0] is other[0][1] and other[0][0] is not main
+    finally:
+        SingletonMeta.reset(Resource)
+
+
+def test_context_scope_gives_each_context_its_own_instance():
+    Resource = _scoped(Scope.CONTEXT)
+    first = contextvars.Context().run(lambda: (Resource(), Resource()))
+    second = contextvars.Context().run(Resource)
+    try:
+        assert first[0] is first[1] and second is not first[0]
+    finally:
+        SingletonMeta.reset(Resource)
+
+
+def test_reset_runs_teardown_and_recreates():
+    Resource = _scoped(Scope.PROCESS)
+    torn_down = []
+    SingletonMeta.add_teardown_hook(lambda cls, instance: torn_down.append((cls, instance)))
+    try:
+        first = Resource()
+        SingletonMeta.reset(Resource)
+        assert first.closed and (Resource, first) in torn_down
+        second = Resource()
+        assert second is not first and not second.closed
+        SingletonMeta.reset(Resource, teardown=False)
+        assert not second.closed
+    finally:
+        SingletonMeta._teardown_hooks.pop()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_fork_recreates_instances_of_every_scope():
+    classes = [_scoped(scope) for scope in (Scope.PROCESS, Scope.THREAD, Scope.CONTEXT)]
+    parents = [cls() for cls in classes]
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            fresh = all(cls() is not parent and cls() is cls() for cls, parent in zip(classes, parents))
+            os.write(write_end, b"1" if fresh else b"0")
+        finally:
+            os._exit(0)
+    os.close(write_end)
+    try:
+        assert os.read(read_end, 1) == b"1"
+        assert all(cls() is parent for cls, parent in zip(classes, parents))
+    finally:
+        os.close(read_end)
+        os.waitpid(pid, 0)
+        for cls in classes:
+            SingletonMeta.reset(cls)